@@ -1,160 +1,364 @@
+import argparse
+import functools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 
-def detailed_analysis():
+from snapshots import DATA_DIR, ROOT_DIR, iter_chunks, load_table
+
+JSON_PATH = os.path.join(ROOT_DIR, 'reports', 'detailed_analysis.json')
+
+# Code columns read as categoricals so filters and groupbys work on small
+# integer codes instead of Python strings
+CATEGORICAL_COLUMNS = {
+    'PWS_ACTIVITY_CODE', 'PWS_TYPE_CODE', 'PRIMARY_SOURCE_CODE', 'SUBMISSIONYEARQUARTER',
+    'VIOLATION_CATEGORY_CODE', 'IS_HEALTH_BASED_IND', 'VIOLATION_STATUS',
+    'CONTAMINANT_CODE', 'AREA_TYPE_CODE', 'COUNTY_SERVED',
+    'FACILITY_ACTIVITY_CODE', 'FACILITY_TYPE_CODE',
+}
+
+MISSING_DATA_COLUMNS = ['PWS_NAME', 'POPULATION_SERVED_COUNT', 'EMAIL_ADDR', 'PHONE_NUMBER']
+
+CHUNK_SIZE = 250_000
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines in chunked mode
+
+def categorize(frame):
+    return frame.astype({col: 'category' for col in frame.columns if col in CATEGORICAL_COLUMNS})
+
+def iter_frames(table, columns, data_dir=DATA_DIR, chunk_size=None):
+    """The table as one frame, or streamed in ``chunk_size``-row frames"""
+    if not chunk_size:
+        yield categorize(load_table(table, columns, data_dir))
+        return
+    rows = 0
+    next_report = time.perf_counter() + PROGRESS_INTERVAL
+    for frame in iter_chunks(table, columns, chunk_size, data_dir):
+        yield categorize(frame)
+        rows += len(frame)
+        if time.perf_counter() >= next_report:
+            print(f"  … {table}: {rows:,} rows")
+            next_report = time.perf_counter() + PROGRESS_INTERVAL
+
+def add_counts(counts, series):
+    """Add a frame's value counts into the running {value: count} dict"""
+    for value, count in series.value_counts().items():
+        if count:
+            counts[str(value)] = counts.get(str(value), 0) + int(count)
+
+def top_counts(counts, top=None):
+    ordered = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return dict(ordered[:top] if top else ordered)
+
+def _min(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+def _max(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+def _scalar(value):
+    return None if pd.isna(value) else value
+
+# Each section folds frames into running totals with ``update`` and reports
+# them with ``result``, so a table can be fed whole or in chunks.
+
+class SystemsSection:
+    table = 'sdwa_pub_water_systems'
+    columns = ['PWS_NAME', 'PWS_ACTIVITY_CODE', 'PWS_TYPE_CODE', 'POPULATION_SERVED_COUNT',
+               'PRIMARY_SOURCE_CODE', 'EMAIL_ADDR', 'PHONE_NUMBER', 'SUBMISSIONYEARQUARTER',
+               'LAST_REPORTED_DATE']
+
+    def __init__(self):
+        self.total = self.active = 0
+        self.system_types, self.source_types = {}, {}
+        self.population_total = self.population_count = 0
+        self.missing = dict.fromkeys(MISSING_DATA_COLUMNS, 0)
+        self.submission_quarter = None
+        self.first_reported = self.last_reported = None
+
+    def update(self, pws_df):
+        active_systems = pws_df[pws_df['PWS_ACTIVITY_CODE'] == 'A']
+        population = active_systems['POPULATION_SERVED_COUNT']
+        self.total += len(pws_df)
+        self.active += len(active_systems)
+        add_counts(self.system_types, active_systems['PWS_TYPE_CODE'])
+        add_counts(self.source_types, active_systems['PRIMARY_SOURCE_CODE'])
+        self.population_total += float(population.sum())
+        self.population_count += int(population.count())
+        # One pass over the null masks for every column
+        for col, missing in pws_df[MISSING_DATA_COLUMNS].isna().sum().items():
+            self.missing[col] += int(missing)
+        if self.submission_quarter is None and len(pws_df):
+            self.submission_quarter = str(pws_df['SUBMISSIONYEARQUARTER'].iloc[0])
+        first, last = pws_df['LAST_REPORTED_DATE'].agg(['min', 'max'])
+        self.first_reported = _min(self.first_reported, _scalar(first))
+        self.last_reported = _max(self.last_reported, _scalar(last))
+
+    def result(self):
+        return {
+            'total': self.total,
+            'active': self.active,
+            'inactive': self.total - self.active,
+            'system_types': top_counts(self.system_types),
+            'population_total': self.population_total,
+            'population_average': (self.population_total / self.population_count
+                                   if self.population_count else 0.0),
+            'source_types': top_counts(self.source_types),
+            'missing_pct': {col: missing * 100 / self.total if self.total else 0.0
+                            for col, missing in self.missing.items()},
+            'submission_quarter': self.submission_quarter,
+            'last_reported_range': [None if date is None else f'{date:%Y-%m-%d}'
+                                    for date in (self.first_reported, self.last_reported)],
+        }
+
+class ViolationsSection:
+    table = 'sdwa_violations_enforcement'
+    columns = ['VIOLATION_CATEGORY_CODE', 'IS_HEALTH_BASED_IND', 'VIOLATION_STATUS']
+
+    def __init__(self):
+        self.total = self.health_based = 0
+        self.categories, self.status = {}, {}
+
+    def update(self, violations_df):
+        self.total += len(violations_df)
+        add_counts(self.categories, violations_df['VIOLATION_CATEGORY_CODE'])
+        self.health_based += int((violations_df['IS_HEALTH_BASED_IND'] == 'Y').sum())
+        add_counts(self.status, violations_df['VIOLATION_STATUS'])
+
+    def result(self):
+        return {
+            'total': self.total,
+            'categories': top_counts(self.categories, top=10),
+            'health_based': self.health_based,
+            'status': top_counts(self.status),
+        }
+
+class SamplesSection:
+    table = 'sdwa_lcr_samples'
+    columns = ['CONTAMINANT_CODE', 'SAMPLE_MEASURE']
+
+    def __init__(self):
+        self.total = self.measure_count = 0
+        self.measure_sum = 0.0
+        self.measure_max = None
+        self.contaminants = {}
+
+    def update(self, samples_df):
+        self.total += len(samples_df)
+        add_counts(self.contaminants, samples_df['CONTAMINANT_CODE'])
+        count, total, maximum = samples_df['SAMPLE_MEASURE'].agg(['count', 'sum', 'max'])
+        self.measure_count += int(count)
+        self.measure_sum += float(total)
+        self.measure_max = _max(self.measure_max, _scalar(maximum))
+
+    def result(self):
+        return {
+            'total': self.total,
+            'contaminants': top_counts(self.contaminants),
+            'measures': {
+                'count': self.measure_count,
+                'mean': self.measure_sum / self.measure_count if self.measure_count else None,
+                'max': None if self.measure_max is None else float(self.measure_max),
+            },
+        }
+
+class GeoSection:
+    table = 'sdwa_geographic_areas'
+    columns = ['AREA_TYPE_CODE', 'COUNTY_SERVED', 'CITY_SERVED', 'ZIP_CODE_SERVED']
+    # Area type whose rows name each kind of place
+    AREA_COLUMNS = {'CN': 'COUNTY_SERVED', 'CT': 'CITY_SERVED', 'ZC': 'ZIP_CODE_SERVED'}
+
+    def __init__(self):
+        # Distinct places are bounded by geography, not by row count
+        self.places = {area_type: set() for area_type in self.AREA_COLUMNS}
+        self.county_systems = {}
+
+    def update(self, geo_df):
+        for area_type, rows in geo_df.groupby('AREA_TYPE_CODE', observed=True):
+            column = self.AREA_COLUMNS.get(area_type)
+            if column:
+                self.places[area_type].update(rows[column].dropna().astype(str).unique())
+        add_counts(self.county_systems, geo_df.loc[geo_df['AREA_TYPE_CODE'] == 'CN', 'COUNTY_SERVED'])
+
+    def result(self):
+        return {
+            'counties': len(self.places['CN']),
+            'cities': len(self.places['CT']),
+            'zip_codes': len(self.places['ZC']),
+            'top_counties': top_counts(self.county_systems, top=5),
+        }
+
+class FacilitiesSection:
+    table = 'sdwa_facilities'
+    columns = ['FACILITY_ACTIVITY_CODE', 'FACILITY_TYPE_CODE']
+
+    def __init__(self):
+        self.total = self.active = 0
+        self.types = {}
+
+    def update(self, facilities_df):
+        active = facilities_df['FACILITY_ACTIVITY_CODE'] == 'A'
+        self.total += len(facilities_df)
+        self.active += int(active.sum())
+        add_counts(self.types, facilities_df.loc[active, 'FACILITY_TYPE_CODE'])
+
+    def result(self):
+        return {
+            'total': self.total,
+            'active': self.active,
+            'top_types': top_counts(self.types, top=10),
+        }
+
+SECTIONS = {
+    'systems': SystemsSection,
+    'violations': ViolationsSection,
+    'samples': SamplesSection,
+    'geo': GeoSection,
+    'facilities': FacilitiesSection,
+}
+
+def timed_section(name, data_dir=DATA_DIR, chunk_size=None):
+    """Run one section (in a worker process); returns (name, result, seconds)"""
+    start = time.perf_counter()
+    section = SECTIONS[name]()
+    for frame in iter_frames(section.table, section.columns, data_dir, chunk_size):
+        section.update(frame)
+    return name, section.result(), time.perf_counter() - start
+
+def run_sections(workers=None, data_dir=DATA_DIR, chunk_size=None):
+    """Compute every section, in parallel across processes when workers > 1.
+
+    ``chunk_size`` streams each table from CSV in bounded-memory chunks.
+    Returns ({section: result}, {section: seconds}).
+    """
+    workers = workers or min(len(SECTIONS), os.cpu_count() or 1)
+    run = functools.partial(timed_section, data_dir=data_dir, chunk_size=chunk_size)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(run, SECTIONS))
+    else:
+        outcomes = [run(name) for name in SECTIONS]
+    results = {name: result for name, result, _ in outcomes}
+    timings = {name: seconds for name, _, seconds in outcomes}
+    return results, timings
+
+def print_counts(title, counts):
+    print(f"\n{title}")
+    for value, count in counts.items():
+        print(f"  - {value}: {count:,}")
+
+def print_report(report):
+    """Render the section results as the text report"""
     print("=" * 80)
     print("DETAILED GEORGIA WATER QUALITY DATA ANALYSIS")
     print("=" * 80)
-    
-    # Load key files
-    print("Loading data files...")
-    
-    # Water Systems
-    pws_df = pd.read_csv('data/SDWA_PUB_WATER_SYSTEMS.csv')
-    
-    # Violations
-    violations_df = pd.read_csv('data/SDWA_VIOLATIONS_ENFORCEMENT.csv', low_memory=False)
-    
-    # Samples
-    samples_df = pd.read_csv('data/SDWA_LCR_SAMPLES.csv')
-    
-    # Geographic
-    geo_df = pd.read_csv('data/SDWA_GEOGRAPHIC_AREAS.csv')
-    
-    # Facilities
-    facilities_df = pd.read_csv('data/SDWA_FACILITIES.csv')
-    
     print("Analysis complete!")
     print()
-    
+
     # 1. WATER SYSTEMS ANALYSIS
+    systems = report['systems']
     print("1. WATER SYSTEMS OVERVIEW")
     print("-" * 40)
-    active_systems = pws_df[pws_df['PWS_ACTIVITY_CODE'] == 'A']
-    print(f"• Total water systems: {len(pws_df):,}")
-    print(f"• Active systems: {len(active_systems):,}")
-    print(f"• Inactive systems: {len(pws_df) - len(active_systems):,}")
-    
-    # System types
-    system_types = active_systems['PWS_TYPE_CODE'].value_counts()
-    print("\nSystem Types:")
-    for sys_type, count in system_types.items():
-        print(f"  - {sys_type}: {count:,}")
-    
-    # Population served
-    total_pop = active_systems['POPULATION_SERVED_COUNT'].sum()
-    avg_pop = active_systems['POPULATION_SERVED_COUNT'].mean()
+    print(f"• Total water systems: {systems['total']:,}")
+    print(f"• Active systems: {systems['active']:,}")
+    print(f"• Inactive systems: {systems['inactive']:,}")
+    print_counts("System Types:", systems['system_types'])
     print(f"\nPopulation Served:")
-    print(f"  - Total: {total_pop:,.0f}")
-    print(f"  - Average per system: {avg_pop:,.0f}")
-    
-    # Source types
-    source_types = active_systems['PRIMARY_SOURCE_CODE'].value_counts()
-    print("\nWater Sources:")
-    for source, count in source_types.items():
-        print(f"  - {source}: {count:,}")
-    
+    print(f"  - Total: {systems['population_total']:,.0f}")
+    print(f"  - Average per system: {systems['population_average']:,.0f}")
+    print_counts("Water Sources:", systems['source_types'])
     print()
-    
+
     # 2. VIOLATIONS ANALYSIS
+    violations = report['violations']
     print("2. VIOLATIONS OVERVIEW")
     print("-" * 40)
-    print(f"• Total violations: {len(violations_df):,}")
-    
-    # Violation categories
-    violation_cats = violations_df['VIOLATION_CATEGORY_CODE'].value_counts()
-    print("\nViolation Categories:")
-    for cat, count in violation_cats.head(10).items():
-        print(f"  - {cat}: {count:,}")
-    
-    # Health-based violations
-    health_violations = violations_df[violations_df['IS_HEALTH_BASED_IND'] == 'Y']
-    print(f"\nHealth-based violations: {len(health_violations):,}")
-    
-    # Violation status
-    status_counts = violations_df['VIOLATION_STATUS'].value_counts()
-    print("\nViolation Status:")
-    for status, count in status_counts.items():
-        print(f"  - {status}: {count:,}")
-    
+    print(f"• Total violations: {violations['total']:,}")
+    print_counts("Violation Categories:", violations['categories'])
+    print(f"\nHealth-based violations: {violations['health_based']:,}")
+    print_counts("Violation Status:", violations['status'])
     print()
-    
+
     # 3. SAMPLING DATA
+    samples = report['samples']
     print("3. LEAD & COPPER SAMPLING")
     print("-" * 40)
-    print(f"• Total samples: {len(samples_df):,}")
-    
-    # Contaminants
-    contaminants = samples_df['CONTAMINANT_CODE'].value_counts()
-    print("\nContaminants sampled:")
-    for cont, count in contaminants.items():
-        print(f"  - {cont}: {count:,}")
-    
-    # Sample measures (if available)
-    if 'SAMPLE_MEASURE' in samples_df.columns:
-        valid_measures = samples_df['SAMPLE_MEASURE'].dropna()
-        if len(valid_measures) > 0:
-            print(f"\nSample measurements:")
-            print(f"  - Valid measurements: {len(valid_measures):,}")
-            print(f"  - Average: {valid_measures.mean():.4f}")
-            print(f"  - Max: {valid_measures.max():.4f}")
-    
+    print(f"• Total samples: {samples['total']:,}")
+    print_counts("Contaminants sampled:", samples['contaminants'])
+    measures = samples['measures']
+    if measures['count'] > 0:
+        print(f"\nSample measurements:")
+        print(f"  - Valid measurements: {measures['count']:,}")
+        print(f"  - Average: {measures['mean']:.4f}")
+        print(f"  - Max: {measures['max']:.4f}")
     print()
-    
+
     # 4. GEOGRAPHIC COVERAGE
+    geo = report['geo']
     print("4. GEOGRAPHIC COVERAGE")
     print("-" * 40)
-    counties = geo_df[geo_df['AREA_TYPE_CODE'] == 'CN']['COUNTY_SERVED'].nunique()
-    cities = geo_df[geo_df['AREA_TYPE_CODE'] == 'CT']['CITY_SERVED'].nunique()
-    zip_codes = geo_df[geo_df['AREA_TYPE_CODE'] == 'ZC']['ZIP_CODE_SERVED'].nunique()
-    
-    print(f"• Counties covered: {counties}")
-    print(f"• Cities covered: {cities}")
-    print(f"• ZIP codes covered: {zip_codes}")
-    
-    # Top counties
-    top_counties = geo_df[geo_df['AREA_TYPE_CODE'] == 'CN']['COUNTY_SERVED'].value_counts().head(5)
-    print("\nTop counties by water systems:")
-    for county, count in top_counties.items():
-        print(f"  - {county}: {count}")
-    
+    print(f"• Counties covered: {geo['counties']}")
+    print(f"• Cities covered: {geo['cities']}")
+    print(f"• ZIP codes covered: {geo['zip_codes']}")
+    print_counts("Top counties by water systems:", geo['top_counties'])
     print()
-    
+
     # 5. FACILITIES ANALYSIS
+    facilities = report['facilities']
     print("5. FACILITIES OVERVIEW")
     print("-" * 40)
-    active_facilities = facilities_df[facilities_df['FACILITY_ACTIVITY_CODE'] == 'A']
-    print(f"• Total facilities: {len(facilities_df):,}")
-    print(f"• Active facilities: {len(active_facilities):,}")
-    
-    # Facility types
-    facility_types = active_facilities['FACILITY_TYPE_CODE'].value_counts()
-    print("\nTop facility types:")
-    for ftype, count in facility_types.head(10).items():
-        print(f"  - {ftype}: {count:,}")
-    
+    print(f"• Total facilities: {facilities['total']:,}")
+    print(f"• Active facilities: {facilities['active']:,}")
+    print_counts("Top facility types:", facilities['top_types'])
     print()
-    
+
     # 6. DATA QUALITY ASSESSMENT
     print("6. DATA QUALITY ASSESSMENT")
     print("-" * 40)
-    
-    # Missing data analysis
     print("Missing data percentages:")
-    for col in ['PWS_NAME', 'POPULATION_SERVED_COUNT', 'EMAIL_ADDR', 'PHONE_NUMBER']:
-        if col in pws_df.columns:
-            missing_pct = (pws_df[col].isna().sum() / len(pws_df)) * 100
-            print(f"  - {col}: {missing_pct:.1f}% missing")
-    
-    # Recent data
+    for col, missing_pct in systems['missing_pct'].items():
+        print(f"  - {col}: {missing_pct:.1f}% missing")
+    first_reported, last_reported = systems['last_reported_range']
     print(f"\nData currency:")
-    print(f"  - Submission quarter: {pws_df['SUBMISSIONYEARQUARTER'].iloc[0]}")
-    print(f"  - Last reported dates range: {pws_df['LAST_REPORTED_DATE'].min()} to {pws_df['LAST_REPORTED_DATE'].max()}")
-    
+    print(f"  - Submission quarter: {systems['submission_quarter']}")
+    print(f"  - Last reported dates range: {first_reported} to {last_reported}")
+
     print()
     print("=" * 80)
     print("DETAILED ANALYSIS COMPLETE")
     print("=" * 80)
 
+def detailed_analysis(json_path=JSON_PATH, workers=None, timing=False, data_dir=DATA_DIR,
+                      chunk_size=None):
+    start = time.perf_counter()
+    report, timings = run_sections(workers, data_dir, chunk_size)
+    print_report(report)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"JSON report written to {json_path}")
+
+    if timing:
+        print("\nTiming (load + compute per section):")
+        for name, seconds in timings.items():
+            print(f"  - {name}: {seconds * 1000:,.1f} ms")
+        print(f"  - total wall time: {(time.perf_counter() - start) * 1000:,.1f} ms")
+    return report
+
 if __name__ == "__main__":
-    detailed_analysis() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Georgia water quality data report')
+    parser.add_argument('--json', default=JSON_PATH, help='where to write the JSON report')
+    parser.add_argument('--no-json', action='store_true', help='text report only')
+    parser.add_argument('--workers', type=int, help='processes for the sections (1 = serial)')
+    parser.add_argument('--timing', action='store_true', help='print time per section')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory of SDWA CSV exports')
+    parser.add_argument('--chunked', action='store_true',
+                        help='stream CSVs in fixed-size chunks (bounded memory, for large exports)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    detailed_analysis(None if args.no_json else args.json, args.workers, args.timing,
+                      args.data_dir, args.chunk_size if args.chunked else None)
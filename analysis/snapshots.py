@@ -0,0 +1,145 @@
+"""Typed, dictionary-encoded Parquet snapshots of the SDWA CSVs.
+
+Analysis scripts re-parsed every CSV as object columns on each run. Snapshots
+are converted once using the same column types as the SQLite ingest (integer
+counts, float measures, real dates, low-cardinality codes as categoricals) and
+written as Parquet, so ``load_table`` can read just the columns a job needs.
+A snapshot is rebuilt automatically when its CSV is newer.
+
+    python analysis/snapshots.py [--force]
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+import ingest  # shared column types and file list
+
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+SNAPSHOT_DIR = 'snapshots'  # under the data directory
+
+# Text columns with at most this share of distinct values become categoricals
+# (stored dictionary-encoded); IDs and free text stay plain strings
+CATEGORY_MAX_RATIO = 0.5
+
+try:
+    import pyarrow
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+
+def csv_path(table, data_dir=DATA_DIR):
+    return os.path.join(data_dir, table.upper() + '.csv')
+
+
+def snapshot_path(table, data_dir=DATA_DIR, snapshot_dir=None):
+    return os.path.join(snapshot_dir or os.path.join(data_dir, SNAPSHOT_DIR), table + '.parquet')
+
+
+def convert_column(name, values):
+    """Convert a column of CSV strings to its typed pandas form"""
+    kind = ingest.column_type(name)
+    if kind == 'INTEGER':
+        return pd.to_numeric(values, errors='coerce').astype('Int64')
+    if kind == 'REAL':
+        return pd.to_numeric(values, errors='coerce')
+    if kind == 'DATE':
+        values = values.mask(values == ingest.OPEN_ENDED_DATE)
+        return pd.to_datetime(values, format='%m/%d/%Y', errors='coerce')
+    if values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+        return values.astype('category')
+    return values.astype('string')
+
+
+def convert_frame(frame):
+    return frame.apply(lambda column: convert_column(column.name, column))
+
+
+def read_csv_typed(path, columns=None, chunksize=None):
+    """Read a SDWA CSV (optionally only ``columns``) with typed columns.
+
+    With ``chunksize``, returns an iterator of typed frames of that many rows.
+    """
+    frames = pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False,
+                         na_values=[''], chunksize=chunksize)
+    if chunksize:
+        return (convert_frame(frame) for frame in frames)
+    return convert_frame(frames)
+
+
+def write_snapshot(table, data_dir=DATA_DIR, snapshot_dir=None):
+    """Convert one CSV to a Parquet snapshot; returns (rows, seconds)"""
+    start = time.perf_counter()
+    frame = read_csv_typed(csv_path(table, data_dir))
+    path = snapshot_path(table, data_dir, snapshot_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    frame.to_parquet(tmp_path, engine='pyarrow', compression='zstd', index=False)
+    os.replace(tmp_path, path)
+    return len(frame), time.perf_counter() - start
+
+
+def is_fresh(table, data_dir=DATA_DIR, snapshot_dir=None):
+    path = snapshot_path(table, data_dir, snapshot_dir)
+    return (os.path.exists(path)
+            and os.path.getmtime(path) >= os.path.getmtime(csv_path(table, data_dir)))
+
+
+def load_table(table, columns=None, data_dir=DATA_DIR, snapshot_dir=None):
+    """Typed DataFrame for a SDWA table (e.g. 'sdwa_lcr_samples').
+
+    Reads only ``columns`` when given. Builds or refreshes the snapshot
+    first; without pyarrow it falls back to a typed CSV read. A table whose
+    CSV is missing comes back empty with the requested columns.
+    """
+    if not os.path.exists(csv_path(table, data_dir)):
+        return pd.DataFrame(columns=columns or [])
+    if not HAVE_PYARROW:
+        return read_csv_typed(csv_path(table, data_dir), columns)
+    if not is_fresh(table, data_dir, snapshot_dir):
+        write_snapshot(table, data_dir, snapshot_dir)
+    return pd.read_parquet(snapshot_path(table, data_dir, snapshot_dir), columns=columns)
+
+
+def iter_chunks(table, columns=None, chunksize=100_000, data_dir=DATA_DIR):
+    """Stream a SDWA table from its CSV as typed frames of ``chunksize`` rows.
+
+    For exports too large to load or snapshot in memory; nothing is yielded
+    when the CSV is missing.
+    """
+    path = csv_path(table, data_dir)
+    if os.path.exists(path):
+        yield from read_csv_typed(path, columns, chunksize)
+
+
+def build_snapshots(data_dir=DATA_DIR, snapshot_dir=None, force=False):
+    """Write a snapshot for every CSV that is new or changed"""
+    for csv_file in ingest.CSV_FILES:
+        table = ingest.table_name_for(csv_file)
+        if not os.path.exists(csv_path(table, data_dir)):
+            print(f"⚠️  {csv_file} not found, skipping")
+            continue
+        if not force and is_fresh(table, data_dir, snapshot_dir):
+            print(f"✓ {table}: up to date")
+            continue
+        rows, seconds = write_snapshot(table, data_dir, snapshot_dir)
+        csv_mb = os.path.getsize(csv_path(table, data_dir)) / 1e6
+        parquet_mb = os.path.getsize(snapshot_path(table, data_dir, snapshot_dir)) / 1e6
+        print(f"✅ {table}: {rows:,} rows, {csv_mb:.1f} MB CSV -> {parquet_mb:.1f} MB Parquet "
+              f"in {seconds:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert SDWA CSVs to Parquet snapshots')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--snapshot-dir', help='default: <data-dir>/snapshots')
+    parser.add_argument('--force', action='store_true', help='rebuild every snapshot')
+    args = parser.parse_args()
+    if not HAVE_PYARROW:
+        sys.exit('pyarrow is required to write snapshots (pip install pyarrow)')
+    build_snapshots(args.data_dir, args.snapshot_dir, args.force)
@@ -1,14 +1,28 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context
 from flask_cors import CORS
-import sqlite3
-import csv
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
+from contextlib import closing
 from datetime import datetime
 import json
+import sqlite3
+import threading
+import time
 from openai_service import FUNCTIONS, execute_function_call
-from collections import defaultdict
+import ingest
+import codes
+import db
+import locator
+import metrics
+from db import check_query_plans, get_db
+from cache import CACHE_PARAMS, LRUCache, cached_response
+import scorecards
+import search
+import summaries
+from pagination import list_response, paginate
+from session_store import SessionStore
+from tools import ToolRunner
 
 # Load environment variables
 
@@ -37,86 +51,91 @@ else:
 
 # Database setup
 DATABASE_PATH = os.getenv('DATABASE_PATH', './water_quality.db')
+# Pooled read-only connections per worker; set DB_POOL_SIZE=0 to open a fresh
+# connection per request instead (useful for latency comparisons). The default
+# covers every request thread (WEB_THREADS, as in gunicorn.conf.py) plus the
+# tool-call workers, so a busy worker never waits on the pool.
+TOOL_WORKERS = int(os.getenv('TOOL_WORKERS', '8'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE',
+                             str(int(os.getenv('WEB_THREADS', '16')) + TOOL_WORKERS)))
+db.init_app(app, DATABASE_PATH, DB_POOL_SIZE)
+# Per-route latency, SQL and serialization time for /api/metrics; set
+# SLOW_QUERY_MS to log slower statements with their query plan
+metrics.init_app(app, slow_query_ms=float(os.getenv('SLOW_QUERY_MS', '0')))
+
+# Cached GET responses, keyed on route + query args + data version
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+response_cache = LRUCache(
+    maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', '1024')),
+    ttl=RESPONSE_CACHE_TTL,
+)
+
+# Chat history, persisted outside the read-only data DB and shared by workers.
+# Older turns are compacted into a summary once a session exceeds its budgets.
+session_store = SessionStore(
+    os.getenv('CHAT_SESSION_DB', './chat_sessions.db'),
+    max_turns=int(os.getenv('CHAT_MAX_TURNS', '20')),
+    max_tokens=int(os.getenv('CHAT_MAX_TOKENS', '4000')),
+    idle_ttl=int(os.getenv('CHAT_SESSION_TTL', str(24 * 3600))),
+    global_max_tokens=int(os.getenv('CHAT_GLOBAL_MAX_TOKENS', '5000000')),
+)
+
+# Tool calls from one chat turn run concurrently, each with its own timeout;
+# results are memoized per data version
+tool_runner = ToolRunner(
+    execute_function_call,
+    max_workers=TOOL_WORKERS,
+    timeout=float(os.getenv('TOOL_TIMEOUT', '15')),
+    app=app,
+    cache=LRUCache(maxsize=int(os.getenv('TOOL_CACHE_SIZE', '512')), ttl=RESPONSE_CACHE_TTL),
+)
+
+# ZIP/city/county -> system lookup held in memory and rebuilt per data
+# version; coordinates resolve through an optional local centroid CSV
+place_index = locator.PlaceIndex(
+    os.getenv('GEO_CENTROIDS_PATH', os.path.join(ingest.DATA_DIR, 'centroids.csv')))
+
+# Reference-code descriptions, held in memory per data version for decode=1
+# list responses and chat tool results
+reference_codes = codes.ReferenceCodes()
+
+def load_reference_codes(version=None):
+    """The reference-code table for ``version`` (default: the current data version).
+
+    Reloads through its own short-lived connection, only when the version
+    changed, so a chat turn doesn't keep a pooled connection for it.
+    """
+    if version is None:
+        version = db.get_data_version()[0]
+    if not reference_codes.is_current(version):
+        with closing(db.connect_readonly(DATABASE_PATH)) as conn:
+            reference_codes.refresh(conn, version)
+    return reference_codes
+
+def wants_decode():
+    """True when the request asks for ``decode=1``"""
+    return request.args.get('decode', '').lower() in ('1', 'true', 'yes')
 
-# In-memory session memory (cleared on backend restart)
-session_histories = defaultdict(list)
+def code_decoder():
+    """Row decoder for list responses when the request asks for ``decode=1``"""
+    if not wants_decode():
+        return None
+    return load_reference_codes().row_decoder
 
 def init_database():
     """Initialize SQLite database with water quality data"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    # Load CSV files into SQLite tables
-    csv_files = [
-        'SDWA_PUB_WATER_SYSTEMS.csv',
-        'SDWA_VIOLATIONS_ENFORCEMENT.csv',
-        'SDWA_LCR_SAMPLES.csv',
-        'SDWA_FACILITIES.csv',
-        'SDWA_SITE_VISITS.csv',
-        'SDWA_GEOGRAPHIC_AREAS.csv',
-        'SDWA_EVENTS_MILESTONES.csv',
-        'SDWA_SERVICE_AREAS.csv',
-        'SDWA_PN_VIOLATION_ASSOC.csv',
-        'SDWA_REF_CODE_VALUES.csv'
-    ]
-    
-    for csv_file in csv_files:
-        file_path = f'../data/{csv_file}'
-        if os.path.exists(file_path):
-            table_name = csv_file.replace('.csv', '').lower()
-            
-            # Read CSV and create table
-            with open(file_path, 'r', encoding='utf-8') as f:
-                csv_reader = csv.reader(f)
-                headers = next(csv_reader)
-                
-                # Create table
-                columns = ', '.join([f'"{col}" TEXT' for col in headers])
-                cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
-                cursor.execute(f'CREATE TABLE {table_name} ({columns})')
-                
-                # Insert data
-                for row in csv_reader:
-                    if len(row) == len(headers):  # Ensure row has correct number of columns
-                        placeholders = ', '.join(['?' for _ in headers])
-                        cursor.execute(f'INSERT INTO {table_name} VALUES ({placeholders})', row)
-            
-            print(f"Loaded {csv_file} into {table_name} table")
-    
-    conn.commit()
-    conn.close()
+    return ingest.init_database(DATABASE_PATH)
 
 def get_water_quality_context():
     """Get context about water quality data for OpenAI"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get summary statistics
-    stats = {}
-    
-    # Water systems
-    cursor.execute("SELECT COUNT(*) as total_systems, COUNT(CASE WHEN PWS_ACTIVITY_CODE = 'A' THEN 1 END) as active_systems FROM sdwa_pub_water_systems")
-    result = cursor.fetchone()
-    stats['total_systems'] = result[0] if result else 0
-    stats['active_systems'] = result[1] if result else 0
-    
-    # Violations
-    cursor.execute("SELECT COUNT(*) as total_violations, COUNT(CASE WHEN IS_HEALTH_BASED_IND = 'Y' THEN 1 END) as health_violations FROM sdwa_violations_enforcement")
-    result = cursor.fetchone()
-    stats['total_violations'] = result[0] if result else 0
-    stats['health_violations'] = result[1] if result else 0
-    
-    # Samples
-    cursor.execute("SELECT COUNT(*) as total_samples FROM sdwa_lcr_samples")
-    result = cursor.fetchone()
-    stats['total_samples'] = result[0] if result else 0
-    
-    # Counties
-    cursor.execute("SELECT COUNT(DISTINCT COUNTY_SERVED) as counties FROM sdwa_geographic_areas WHERE AREA_TYPE_CODE = 'CN'")
-    result = cursor.fetchone()
-    stats['counties'] = result[0] if result else 0
-    
-    conn.close()
+    # Summary statistics are precomputed at ingest (see summaries.py)
+    cursor.execute("SELECT key, value FROM summary_overview")
+    stats = dict.fromkeys(['total_systems', 'active_systems', 'total_violations',
+                           'health_violations', 'total_samples', 'counties'], 0)
+    stats.update(cursor.fetchall())
     
     return f"""
     Georgia Water Quality Data Context:
@@ -138,13 +157,100 @@ def get_water_quality_context():
     - sdwa_ref_code_values: Reference codes and descriptions
     """
 
+SYSTEM_PROMPT = """
+You are a helpful, friendly, and conversational assistant for Georgia water quality data. Always use the provided database functions to get REAL data from Georgia's water systems.
+
+Respond in a clear, engaging, and conversational style, like ChatGPT.
+Use markdown formatting for lists, tables, and emphasis.
+If the user includes math or requests formulas, use LaTeX (in markdown, e.g., $E=mc^2$ or $$a^2 + b^2 = c^2$$).
+If the user's question is ambiguous, ask for clarification.
+Always explain your reasoning, highlight important trends, and suggest possible next questions if relevant.
+"""
+
+FOLLOW_UP_PROMPT = "Please explain the significance of this data, highlight any trends, and suggest what a user might want to know next."
+
+CHAT_UNAVAILABLE = "I'm sorry, but the AI chat functionality is currently unavailable. Please check your OpenAI API key."
+
+# A chat turn holds its worker thread for seconds while the model answers.
+# Capping concurrent turns per process keeps threads free for the GET routes;
+# a turn that can't start within CHAT_QUEUE_TIMEOUT gets a 503 to retry.
+CHAT_MAX_CONCURRENCY = int(os.getenv('CHAT_MAX_CONCURRENCY', '4'))
+CHAT_QUEUE_TIMEOUT = float(os.getenv('CHAT_QUEUE_TIMEOUT', '2'))
+chat_slots = threading.BoundedSemaphore(CHAT_MAX_CONCURRENCY)
+metrics.registry.describe('chat_rejected_total', 'counter', 'Chat turns refused while at capacity')
+
+def acquire_chat_slot():
+    """Wait briefly for a chat slot; returns a 503 response if none frees up"""
+    if chat_slots.acquire(timeout=CHAT_QUEUE_TIMEOUT):
+        return None
+    metrics.registry.inc('chat_rejected_total')
+    response = jsonify({'error': 'Chat is busy, please try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+def create_completion(call, **kwargs):
+    """client.chat.completions.create, recording latency and token usage as ``call``"""
+    start = time.perf_counter()
+    completion = client.chat.completions.create(**kwargs)
+    metrics.record_completion(call, time.perf_counter() - start,
+                              getattr(completion, 'usage', None))
+    return completion
+
+def start_chat_turn(session_id, user_message):
+    """Record the user message and make the first (function calling) request.
+
+    Returns the messages for a follow-up request, or None if the first reply
+    is already the answer, and the first response message.
+    """
+    session_store.append(session_id, "user", user_message)
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + session_store.history(session_id)
+    version = db.get_data_version()[0]
+    decoded = load_reference_codes(version)
+    # Tools read through their own app contexts; give back this context's
+    # pooled connection before waiting on the model (an SSE stream keeps the
+    # context alive until the answer is sent)
+    db.release_db()
+    completion = create_completion(
+        'tools',
+        model="gpt-4o",
+        messages=messages,
+        tools=FUNCTIONS,
+        tool_choice="auto",
+        max_tokens=1000,
+        temperature=0.7
+    )
+    response_message = completion.choices[0].message
+    if not response_message.tool_calls:
+        return None, response_message
+
+    messages.append(response_message)
+    tool_calls = response_message.tool_calls
+    calls = [(tool_call.function.name, json.loads(tool_call.function.arguments))
+             for tool_call in tool_calls]
+    results = tool_runner.run(calls, version)
+    # Describe codes inline so the model doesn't spend calls looking them up
+    results = [(decoded.decode_records(result), seconds) for result, seconds in results]
+    print("⏱️  Tools: " + ", ".join(
+        f"{name} {seconds * 1000:.1f}ms" for (name, _), (_, seconds) in zip(calls, results)))
+    for tool_call, (function_name, _), (function_result, _) in zip(tool_calls, calls, results):
+        messages.append({
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": function_name,
+            "content": json.dumps(function_result)
+        })
+    # Add a follow-up message to encourage reasoning and suggestions
+    messages.append({"role": "user", "content": FOLLOW_UP_PROMPT})
+    return messages, response_message
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chatbot conversations with OpenAI using function calling"""
     try:
         if not client:
             return jsonify({
-                'response': "I'm sorry, but the AI chat functionality is currently unavailable. Please check your OpenAI API key.",
+                'response': CHAT_UNAVAILABLE,
                 'timestamp': datetime.now().isoformat()
             }), 200
         
@@ -155,63 +261,28 @@ def chat():
         
         # Use session ID from cookie or default
         session_id = request.cookies.get('session_id', 'default')
-        history = session_histories[session_id]
         
-        # Create system prompt
-        system_prompt = """
-You are a helpful, friendly, and conversational assistant for Georgia water quality data. Always use the provided database functions to get REAL data from Georgia's water systems.
-
-Respond in a clear, engaging, and conversational style, like ChatGPT.
-Use markdown formatting for lists, tables, and emphasis.
-If the user includes math or requests formulas, use LaTeX (in markdown, e.g., $E=mc^2$ or $$a^2 + b^2 = c^2$$).
-If the user's question is ambiguous, ask for clarification.
-Always explain your reasoning, highlight important trends, and suggest possible next questions if relevant.
-"""
-        # Add user message to history
-        history.append({"role": "user", "content": user_message})
-        # Build messages for OpenAI
-        messages = [{"role": "system", "content": system_prompt}] + history
-        # First call to OpenAI with function calling
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            tools=FUNCTIONS,
-            tool_choice="auto",
-            max_tokens=1000,
-            temperature=0.7
-        )
-        response_message = completion.choices[0].message
-        # Check if OpenAI wants to call a function
-        if response_message.tool_calls:
-            messages.append(response_message)
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                function_result = execute_function_call(function_name, function_args)
-                messages.append({
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": json.dumps(function_result)
-                })
-            # Add a follow-up message to encourage reasoning and suggestions
-            messages.append({
-                "role": "user",
-                "content": "Please explain the significance of this data, highlight any trends, and suggest what a user might want to know next."
-            })
-            # Second call to OpenAI with function results
-            second_completion = client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7
-            )
-            bot_response = second_completion.choices[0].message.content
-        else:
-            bot_response = response_message.content
+        busy = acquire_chat_slot()
+        if busy:
+            return busy
+        try:
+            messages, response_message = start_chat_turn(session_id, user_message)
+            if messages:
+                # Second call to OpenAI with function results
+                second_completion = create_completion(
+                    'answer',
+                    model="gpt-4o",
+                    messages=messages,
+                    max_tokens=1000,
+                    temperature=0.7
+                )
+                bot_response = second_completion.choices[0].message.content
+            else:
+                bot_response = response_message.content
+        finally:
+            chat_slots.release()
         # Add assistant response to history
-        history.append({"role": "assistant", "content": bot_response})
-        session_histories[session_id] = history
+        session_store.append(session_id, "assistant", bot_response)
         return jsonify({
             'response': bot_response,
             'timestamp': datetime.now().isoformat()
@@ -222,155 +293,528 @@ Always explain your reasoning, highlight important trends, and suggest possible
             'timestamp': datetime.now().isoformat()
         }), 200
 
+def sse_event(data, event=None):
+    """One Server-Sent Events frame carrying ``data`` as JSON"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming /api/chat: answer tokens arrive as Server-Sent Events.
+
+    Sends ``data: {"delta": ...}`` frames as the answer is generated, then an
+    ``event: done`` frame with the timestamp (or ``event: error``).
+    """
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '')
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+    session_id = request.cookies.get('session_id', 'default')
+    if client:
+        busy = acquire_chat_slot()
+        if busy:
+            return busy
+
+    def generate():
+        if not client:
+            yield sse_event({'delta': CHAT_UNAVAILABLE})
+            yield sse_event({'timestamp': datetime.now().isoformat()}, 'done')
+            return
+        try:
+            messages, response_message = start_chat_turn(session_id, user_message)
+            if not messages:
+                bot_response = response_message.content or ''
+                yield sse_event({'delta': bot_response})
+            else:
+                yield sse_event({'tools': [tool_call.function.name
+                                           for tool_call in response_message.tool_calls]}, 'tools')
+                started = time.perf_counter()
+                stream = client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    max_tokens=1000,
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                parts = []
+                usage = None
+                for chunk in stream:
+                    # Usage arrives on a final chunk with no choices
+                    usage = getattr(chunk, 'usage', None) or usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({'delta': delta})
+                bot_response = ''.join(parts)
+                metrics.record_completion('answer_stream', time.perf_counter() - started, usage)
+            session_store.append(session_id, "assistant", bot_response)
+            yield sse_event({'timestamp': datetime.now().isoformat()}, 'done')
+        except Exception as e:
+            yield sse_event({'error': f"I'm sorry, but I encountered an error while processing your request: {str(e)}. Please try again later."}, 'error')
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    if client:
+        # Held until the stream is fully sent (or the client goes away)
+        response.call_on_close(chat_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
+
+# Route SQL, kept at module level so the startup plan check can EXPLAIN it.
+# List queries end inside their WHERE clause and select their sort column and
+# rowid last; pagination.paginate adds the keyset condition and ORDER BY.
+WATER_SYSTEMS_QUERY = """
+SELECT p.PWSID, p.PWS_NAME, p.POPULATION_SERVED_COUNT, 
+       p.PWS_TYPE_CODE, p.PWS_ACTIVITY_CODE, p.CITY_NAME, p.STATE_CODE,
+       p.POPULATION_SERVED_COUNT, p.rowid
+FROM sdwa_pub_water_systems p
+WHERE p.PWS_ACTIVITY_CODE = 'A'
+"""
+WATER_SYSTEMS_ORDER = ('p.POPULATION_SERVED_COUNT', 'p.rowid')
+
+VIOLATIONS_QUERY = """
+SELECT v.VIOLATION_ID, v.VIOLATION_CODE, v.VIOLATION_CATEGORY_CODE,
+       v.IS_HEALTH_BASED_IND, v.CONTAMINANT_CODE, v.VIOLATION_STATUS,
+       v.NON_COMPL_PER_BEGIN_DATE, v.NON_COMPL_PER_END_DATE,
+       v.VIOL_MEASURE, v.UNIT_OF_MEASURE, v.FEDERAL_MCL,
+       v.NON_COMPL_PER_BEGIN_DATE, v.rowid
+FROM sdwa_violations_enforcement v
+WHERE v.PWSID = ?
+"""
+VIOLATIONS_ORDER = ('v.NON_COMPL_PER_BEGIN_DATE', 'v.rowid')
+
+SAMPLES_QUERY = """
+SELECT s.SAMPLE_ID, s.CONTAMINANT_CODE, s.SAMPLE_MEASURE,
+       s.UNIT_OF_MEASURE, s.SAMPLING_START_DATE, s.SAMPLING_END_DATE,
+       s.SAMPLING_END_DATE, s.rowid
+FROM sdwa_lcr_samples s
+WHERE s.PWSID = ?
+"""
+SAMPLES_ORDER = ('s.SAMPLING_END_DATE', 's.rowid')
+
+COUNTIES_QUERY = """
+SELECT COUNTY_SERVED, system_count
+FROM summary_county
+ORDER BY system_count DESC
+"""
+
+# Trend series from the per-data-version rollups in summaries.py. Each query
+# ends inside its WHERE clause; build_trend_query adds filters and ORDER BY.
+SYSTEM_VIOLATION_TRENDS_QUERY = """
+SELECT quarter AS period, CONTAMINANT_CODE, violation_count, health_violation_count
+FROM summary_violation_quarter
+WHERE PWSID = ?
+"""
+CONTAMINANT_VIOLATION_TRENDS_QUERY = """
+SELECT quarter AS period, CONTAMINANT_CODE, SUM(violation_count) AS violation_count,
+       SUM(health_violation_count) AS health_violation_count, COUNT(DISTINCT PWSID) AS system_count
+FROM summary_violation_quarter
+WHERE CONTAMINANT_CODE = ?
+"""
+STATE_VIOLATION_TRENDS_QUERY = """
+SELECT month AS period, violation_count, health_violation_count, system_count
+FROM summary_violation_month
+WHERE 1
+"""
+SYSTEM_LEAD_COPPER_TRENDS_QUERY = """
+SELECT year AS period, CONTAMINANT_CODE, sample_count, max_measure, exceedance_count
+FROM summary_lcr_year
+WHERE PWSID = ?
+"""
+STATE_LEAD_COPPER_TRENDS_QUERY = """
+SELECT year AS period, CONTAMINANT_CODE, system_count, p50, p90, max_measure,
+       systems_over_action_level
+FROM summary_lcr_percentiles
+WHERE 1
+"""
+
+def build_trend_query(query, params, period, since=None, until=None, contaminant=None,
+                      group_by=None):
+    """Add year bounds, an optional contaminant filter and ordering to a trends query"""
+    params = list(params)
+    if since is not None:
+        query += f" AND {period} >= ?"
+        params.append(str(since))
+    if until is not None:
+        # Periods start with the year ('2023', '2023-05', '2023-Q2')
+        query += f" AND {period} < ?"
+        params.append(str(until + 1))
+    if contaminant:
+        query += " AND CONTAMINANT_CODE = ?"
+        params.append(contaminant)
+    if group_by:
+        query += f" GROUP BY {group_by}"
+    return query + f" ORDER BY {period}", params
+
+def build_trends_queries(pwsid=None, contaminant=None, since=None, until=None):
+    """Return {'violations': (sql, params), 'lead_copper': (sql, params)}"""
+    if pwsid:
+        violations = build_trend_query(SYSTEM_VIOLATION_TRENDS_QUERY, [pwsid], 'quarter',
+                                       since, until, contaminant)
+        lead_copper = build_trend_query(SYSTEM_LEAD_COPPER_TRENDS_QUERY, [pwsid], 'year',
+                                        since, until, contaminant)
+    else:
+        if contaminant:
+            violations = build_trend_query(CONTAMINANT_VIOLATION_TRENDS_QUERY, [contaminant],
+                                           'quarter', since, until, group_by='quarter')
+        else:
+            violations = build_trend_query(STATE_VIOLATION_TRENDS_QUERY, [], 'month',
+                                           since, until)
+        lead_copper = build_trend_query(STATE_LEAD_COPPER_TRENDS_QUERY, [], 'year',
+                                        since, until, contaminant)
+    return {'violations': violations, 'lead_copper': lead_copper}
+
+def build_water_systems_query(county=None, city=None):
+    """Return (sql, params) for /api/water-systems, before ordering"""
+    query = WATER_SYSTEMS_QUERY
+    params = []
+    if county:
+        # COUNTY_SERVED is only set on county rows. A correlated EXISTS (one
+        # (PWSID, AREA_TYPE_CODE, COUNTY_SERVED) index probe per system) keeps
+        # the population index driving the query, so pages need no DISTINCT
+        # or sort step
+        query += (" AND EXISTS (SELECT 1 FROM sdwa_geographic_areas g"
+                  " WHERE g.PWSID = p.PWSID AND g.AREA_TYPE_CODE = 'CN' AND g.COUNTY_SERVED = ?)")
+        params.append(county)
+    if city:
+        # Same LIKE '%city%' match, answered by the trigram index (search.py)
+        query += " AND p.rowid IN (SELECT rowid FROM pws_city_fts WHERE CITY_NAME LIKE ?)"
+        params.append(f'%{city}%')
+    return query, params
+
+def route_queries():
+    """Representative (sql, params) for each route, for the startup plan check"""
+    return {
+        '/api/water-systems': paginate(*build_water_systems_query(), *WATER_SYSTEMS_ORDER, limit=50),
+        '/api/water-systems?county': paginate(
+            *build_water_systems_query(county='Fulton'), *WATER_SYSTEMS_ORDER, limit=50),
+        '/api/water-systems?city': paginate(
+            *build_water_systems_query(city='Atlanta'), *WATER_SYSTEMS_ORDER, limit=50),
+        '/api/violations': paginate(VIOLATIONS_QUERY, ['GA0000000'], *VIOLATIONS_ORDER,
+                                    after=('2020-01-01', 1), limit=50),
+        '/api/samples': paginate(SAMPLES_QUERY, ['GA0000000'], *SAMPLES_ORDER,
+                                 after=('2020-01-01', 1), limit=50),
+        '/api/counties': (COUNTIES_QUERY, []),
+        '/api/search': (search.SEARCH_QUERY, [search.match_expression('Atlanta'), 'Atlanta%', 10]),
+        '/api/systems/<pwsid>/scorecard': (scorecards.SCORECARD_QUERY.format(placeholders='?'),
+                                           ['GA0000000']),
+        '/api/trends?pwsid': build_trends_queries('GA0000000', since=2015)['violations'],
+        '/api/trends?pwsid lead_copper': build_trends_queries('GA0000000')['lead_copper'],
+        '/api/trends?contaminant': build_trends_queries(contaminant='PB90')['violations'],
+    }
+
 @app.route('/api/water-systems', methods=['GET'])
+@cached_response(response_cache)
 def get_water_systems():
-    """Get water systems with optional filtering"""
+    """Get water systems with optional filtering.
+    
+    Paged with ``limit``/``cursor``; ``format=ndjson|csv`` streams everything.
+    """
     try:
         county = request.args.get('county')
         city = request.args.get('city')
-        limit = request.args.get('limit', 50)
         
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT DISTINCT p.PWSID, p.PWS_NAME, p.POPULATION_SERVED_COUNT, 
-               p.PWS_TYPE_CODE, p.PWS_ACTIVITY_CODE, p.CITY_NAME, p.STATE_CODE
-        FROM sdwa_pub_water_systems p
-        LEFT JOIN sdwa_geographic_areas g ON p.PWSID = g.PWSID
-        WHERE p.PWS_ACTIVITY_CODE = 'A'
-        """
-        
-        params = []
-        if county:
-            query += " AND g.COUNTY_SERVED = ?"
-            params.append(county)
-        if city:
-            query += " AND p.CITY_NAME LIKE ?"
-            params.append(f'%{city}%')
-        
-        query += " ORDER BY p.POPULATION_SERVED_COUNT DESC LIMIT ?"
-        params.append(int(limit))
-        
-        cursor.execute(query, params)
-        columns = [description[0] for description in cursor.description]
-        results = []
-        
-        for row in cursor.fetchall():
-            results.append(dict(zip(columns, row)))
-        
-        conn.close()
-        return jsonify(results)
+        query, params = build_water_systems_query(county, city)
+        return list_response(get_db(), query, params, *WATER_SYSTEMS_ORDER, 'water_systems',
+                             code_decoder())
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/violations', methods=['GET'])
+@cached_response(response_cache)
 def get_violations():
-    """Get violations for a specific water system"""
+    """Get violations for a specific water system, newest first.
+    
+    Paged with ``limit``/``cursor``; ``format=ndjson|csv`` streams everything.
+    """
     try:
         pwsid = request.args.get('pwsid')
         if not pwsid:
             return jsonify({'error': 'PWSID required'}), 400
         
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT v.VIOLATION_ID, v.VIOLATION_CODE, v.VIOLATION_CATEGORY_CODE,
-               v.IS_HEALTH_BASED_IND, v.CONTAMINANT_CODE, v.VIOLATION_STATUS,
-               v.NON_COMPL_PER_BEGIN_DATE, v.NON_COMPL_PER_END_DATE,
-               v.VIOL_MEASURE, v.UNIT_OF_MEASURE, v.FEDERAL_MCL
-        FROM sdwa_violations_enforcement v
-        WHERE v.PWSID = ?
-        ORDER BY v.NON_COMPL_PER_BEGIN_DATE DESC
-        LIMIT 50
-        """
-        
-        cursor.execute(query, [pwsid])
-        columns = [description[0] for description in cursor.description]
-        results = []
-        
-        for row in cursor.fetchall():
-            results.append(dict(zip(columns, row)))
-        
-        conn.close()
-        return jsonify(results)
+        return list_response(get_db(), VIOLATIONS_QUERY, [pwsid], *VIOLATIONS_ORDER,
+                             f'violations_{pwsid}', code_decoder())
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/samples', methods=['GET'])
+@cached_response(response_cache)
 def get_samples():
-    """Get lead/copper samples for a specific water system"""
+    """Get lead/copper samples for a specific water system, newest first.
+    
+    Paged with ``limit``/``cursor``; ``format=ndjson|csv`` streams everything.
+    """
     try:
         pwsid = request.args.get('pwsid')
         if not pwsid:
             return jsonify({'error': 'PWSID required'}), 400
         
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT s.SAMPLE_ID, s.CONTAMINANT_CODE, s.SAMPLE_MEASURE,
-               s.UNIT_OF_MEASURE, s.SAMPLING_START_DATE, s.SAMPLING_END_DATE
-        FROM sdwa_lcr_samples s
-        WHERE s.PWSID = ?
-        ORDER BY s.SAMPLING_END_DATE DESC
-        LIMIT 50
-        """
-        
-        cursor.execute(query, [pwsid])
-        columns = [description[0] for description in cursor.description]
-        results = []
-        
-        for row in cursor.fetchall():
-            results.append(dict(zip(columns, row)))
-        
-        conn.close()
-        return jsonify(results)
+        return list_response(get_db(), SAMPLES_QUERY, [pwsid], *SAMPLES_ORDER,
+                             f'samples_{pwsid}', code_decoder())
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Routes whose output has no code columns leave ``decode`` out of their cache
+# key, so decode=1 doesn't store a second copy of the same response
+UNDECODED_CACHE_PARAMS = tuple(param for param in CACHE_PARAMS if param != 'decode')
+
 @app.route('/api/counties', methods=['GET'])
+@cached_response(response_cache, params=UNDECODED_CACHE_PARAMS)
 def get_counties():
     """Get list of counties with water systems"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         
-        query = """
-        SELECT DISTINCT COUNTY_SERVED, COUNT(*) as system_count
-        FROM sdwa_geographic_areas
-        WHERE AREA_TYPE_CODE = 'CN' AND COUNTY_SERVED IS NOT NULL
-        GROUP BY COUNTY_SERVED
-        ORDER BY system_count DESC
-        """
-        
-        cursor.execute(query)
+        cursor.execute(COUNTIES_QUERY)
         columns = [description[0] for description in cursor.description]
         results = []
         
         for row in cursor.fetchall():
             results.append(dict(zip(columns, row)))
         
-        conn.close()
         return jsonify(results)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+MAX_SCORECARD_BATCH = 200
+
+@app.route('/api/systems/<pwsid>/scorecard', methods=['GET'])
+@cached_response(response_cache)
+def get_scorecard(pwsid):
+    """Compliance scorecard for one water system (precomputed at ingest).
+
+    ``decode=1`` adds descriptions for its codes.
+    """
+    try:
+        pwsid = pwsid.strip().upper()
+        documents = scorecards.get_scorecards(get_db(), [pwsid])
+        if pwsid not in documents:
+            return jsonify({'error': f'Unknown PWSID {pwsid}'}), 404
+        # Stored as JSON text, so it is served without re-serializing
+        return app.response_class(scorecard_json(documents[pwsid]), mimetype='application/json')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def scorecard_json(document):
+    """Stored scorecard JSON, with code descriptions when the request asks for ``decode=1``"""
+    if not wants_decode():
+        return document
+    decoded = scorecards.decode_scorecard(json.loads(document), load_reference_codes())
+    return json.dumps(decoded, separators=(',', ':'))
+
+def scorecard_batch_response(pwsids):
+    """{"scorecards": {pwsid: scorecard}, "missing": [...]} for many PWSIDs"""
+    pwsids = list(dict.fromkeys(p.strip().upper() for p in pwsids if p and p.strip()))
+    if not pwsids:
+        return jsonify({'error': 'pwsids required'}), 400
+    if len(pwsids) > MAX_SCORECARD_BATCH:
+        return jsonify({'error': f'At most {MAX_SCORECARD_BATCH} PWSIDs per request'}), 400
+    documents = scorecards.get_scorecards(get_db(), pwsids)
+    body = ','.join(f'{json.dumps(pwsid)}:{scorecard_json(documents[pwsid])}'
+                    for pwsid in pwsids if pwsid in documents)
+    missing = [pwsid for pwsid in pwsids if pwsid not in documents]
+    return app.response_class(f'{{"scorecards":{{{body}}},"missing":{json.dumps(missing)}}}',
+                              mimetype='application/json')
+
+@app.route('/api/systems/scorecards', methods=['GET'])
+@cached_response(response_cache, params=CACHE_PARAMS + ('pwsids',))
+def get_scorecards():
+    """Scorecards for a comma-separated ``pwsids`` list"""
+    try:
+        return scorecard_batch_response(request.args.get('pwsids', '').split(','))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/systems/scorecards', methods=['POST'])
+def post_scorecards():
+    """Scorecards for a JSON body ``{"pwsids": [...]}``"""
+    try:
+        data = request.get_json(silent=True) or {}
+        pwsids = data.get('pwsids')
+        if not isinstance(pwsids, list):
+            return jsonify({'error': 'pwsids must be a list'}), 400
+        return scorecard_batch_response([str(pwsid) for pwsid in pwsids])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+@cached_response(response_cache, params=UNDECODED_CACHE_PARAMS + ('q', 'kind'))
+def search_places():
+    """Type-ahead search over systems, facilities, cities, counties and ZIPs"""
+    try:
+        q = request.args.get('q', '')
+        kind = request.args.get('kind')
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+        return jsonify(search.search(get_db(), q, kind, limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def query_year(name):
+    """Optional four-digit year query arg; raises ValueError otherwise"""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    if not (value.isdigit() and len(value) == 4):
+        raise ValueError(f'{name} must be a year (YYYY)')
+    return int(value)
+
+@app.route('/api/trends', methods=['GET'])
+@cached_response(response_cache, params=CACHE_PARAMS + ('contaminant', 'since', 'until'))
+def get_trends():
+    """Violation and lead/copper history from the rollup tables.
+
+    With ``pwsid``: that system's violations per quarter and contaminant, and
+    its yearly highest PB90/CU90 values. Without: statewide violations per
+    month (per quarter when ``contaminant`` is given) and yearly percentiles
+    of the systems' PB90/CU90 values. ``since``/``until`` bound the years;
+    ``decode=1`` adds CONTAMINANT_CODE_DESCRIPTION.
+    """
+    try:
+        pwsid = request.args.get('pwsid', '').strip().upper() or None
+        contaminant = request.args.get('contaminant', '').strip().upper() or None
+        queries = build_trends_queries(pwsid, contaminant, query_year('since'), query_year('until'))
+        decoder = code_decoder()
+        conn = get_db()
+        result = {'pwsid': pwsid, 'contaminant': contaminant}
+        for name, (query, params) in queries.items():
+            cursor = conn.execute(query, params)
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+            if decoder:
+                columns, decode = decoder(columns)
+                rows = map(decode, rows)
+            result[name] = [dict(zip(columns, row)) for row in rows]
+        result['action_levels'] = summaries.ACTION_LEVELS
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/locate', methods=['GET'])
+@cached_response(response_cache, params=CACHE_PARAMS + ('zip', 'lat', 'lon', 'radius_km'))
+def locate_systems():
+    """Active systems serving a ZIP, city, county or lat/lon, with health violation counts.
+
+    ``decode=1`` adds each system's type_description.
+    """
+    try:
+        radius_km = min(float(request.args.get('radius_km', locator.DEFAULT_RADIUS_KM)),
+                        locator.MAX_RADIUS_KM)
+        place_index.refresh(get_db(), db.get_data_version()[0])
+        if request.args.get('zip'):
+            result = place_index.by_zip(request.args['zip'], radius_km)
+        elif request.args.get('lat') and request.args.get('lon'):
+            result = place_index.by_point(float(request.args['lat']),
+                                          float(request.args['lon']), radius_km)
+        elif request.args.get('city'):
+            result = place_index.by_name('city', request.args['city'])
+        elif request.args.get('county'):
+            result = place_index.by_name('county', request.args['county'])
+        else:
+            return jsonify({'error': 'zip, city, county or lat and lon required'}), 400
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        result['total_systems'] = len(result['systems'])
+        result['systems'] = result['systems'][:limit]
+        if wants_decode():
+            result = load_reference_codes().decode_records(result, locator.CODE_COLUMNS)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except locator.CentroidsUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/codes', methods=['GET'])
+@cached_response(response_cache, params=UNDECODED_CACHE_PARAMS + ('type',))
+def get_codes():
+    """Every reference code as {VALUE_TYPE: {VALUE_CODE: description}}.
+
+    Changes only with the data version, so clients can keep it as long as the
+    ETag holds. ``type`` limits it to one VALUE_TYPE.
+    """
+    try:
+        value_type = request.args.get('type', '').strip().upper() or None
+        return jsonify(load_reference_codes().by_type(value_type))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Response cache counters, for sizing RESPONSE_CACHE_SIZE"""
+    return jsonify(response_cache.stats())
+
+@app.route('/api/chat/stats', methods=['GET'])
+def chat_stats():
+    """Chat session store size and per-tool call latencies"""
+    return jsonify({
+        'sessions': session_store.stats(),
+        'tools': tool_runner.timings.stats(),
+        'tool_cache': tool_runner.cache.stats(),
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, SQL and OpenAI metrics in the Prometheus text format"""
+    version, _ = db.get_data_version()
+    cache = response_cache.stats()
+    gauges = [
+        ('sdwa_data_info', 'Loaded data version', {'version': version or ''}, int(bool(version))),
+        ('response_cache_entries', 'Cached responses', {}, cache['size']),
+        ('response_cache_hits', 'Response cache hits since start', {}, cache['hits']),
+        ('response_cache_misses', 'Response cache misses since start', {}, cache['misses']),
+    ]
+    return Response(metrics.registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Recent statements over SLOW_QUERY_MS, newest first, with their plans"""
+    return jsonify(list(reversed(metrics.slow_queries)))
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    """Readiness: the database answers and an ingest has recorded a data version"""
+    try:
+        get_db().execute('SELECT 1').fetchone()
+        version, built_at = db.get_data_version()
+        database = 'ready' if version else 'not loaded'
+    except (sqlite3.Error, RuntimeError) as e:
+        version, built_at = None, None
+        database = f'unavailable: {e}'
+    healthy = database == 'ready'
+    return jsonify({
+        'status': 'healthy' if healthy else 'unavailable',
+        'database': database,
+        'data_version': version,
+        'data_built_at': built_at.isoformat() if built_at else None,
+        'timestamp': datetime.now().isoformat(),
+    }), 200 if healthy else 503
 
 if __name__ == '__main__':
-    # Initialize database on first run
-    if not os.path.exists(DATABASE_PATH):
-        print("Initializing database...")
-        init_database()
-        print("Database initialized successfully!")
+    # Load the database on first run; later runs only reload changed CSVs
+    print("Refreshing database...")
+    init_database()
+    print("Database ready!")
+    with app.app_context():
+        print(f"Loaded {len(load_reference_codes().codes):,} reference codes")
+    check_query_plans(DATABASE_PATH, route_queries())
     
-    app.run(debug=True, host='0.0.0.0', port=5000) 
+    # Development server; for production use gunicorn -c gunicorn.conf.py app:app
+    app.run(debug=os.getenv('FLASK_DEBUG', '1') == '1', host='0.0.0.0', port=5000,
+            threaded=True) 
@@ -0,0 +1,423 @@
+"""Reproducible benchmarks for the ingest path, the API and chat.
+
+    python benchmarks/benchmark.py [--suites ingest api chat] [--scales 1 10 100]
+        [--concurrency 8] [--requests 200] [--compare OLD.json]
+
+ingest  loads every CSV into a fresh database at each scale (the bundled data,
+        then synthetic copies where each row repeats under new keys) and
+        records rows/sec per file.
+api     replays a fixed request mix through Flask's test client from
+        ``--concurrency`` threads, with the connection pool on and off and the
+        response cache bypassed, then once with the cache on, and records
+        latency percentiles per endpoint.
+chat    times /api/chat and /api/chat/stream end to end with ``app.client``
+        swapped for a stub that answers after ``--chat-delay`` seconds, so
+        only our own overhead (history, tools, streaming) is measured.
+
+Results go to one JSON file tagged with the git commit (default
+reports/benchmarks/); ``--compare`` prints the change from an earlier run.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from urllib.parse import quote
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+import ingest
+
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+OUTPUT_DIR = os.path.join(ROOT_DIR, 'reports', 'benchmarks')
+PERCENTILES = (50, 90, 95, 99)
+INTEGER_KEY_OFFSET = 10 ** 12  # added per synthetic copy to integer keys (SAR_ID)
+SAMPLE_SYSTEMS = 20  # distinct PWSIDs/counties rotated through the request mix
+CHAT_MESSAGE = 'Are there any lead problems in Fulton County?'
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far"""
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / 1024 if sys.platform != 'darwin' else kb / 1024 ** 2, 1)
+
+
+def latency_summary(latencies, errors=0, seconds=None):
+    """Count, error count, throughput and percentiles (ms) for a list of seconds"""
+    ordered = sorted(latencies)
+    summary = {'requests': len(ordered), 'errors': errors}
+    if seconds:
+        summary['per_sec'] = round(len(ordered) / seconds, 1)
+    if not ordered:
+        return summary
+    summary['mean_ms'] = round(sum(ordered) / len(ordered) * 1000, 3)
+    for p in PERCENTILES:
+        index = min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))
+        summary[f'p{p}_ms'] = round(ordered[index] * 1000, 3)
+    summary['max_ms'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+# --- ingest ---------------------------------------------------------------
+
+def scale_csv(source, target, table_name, factor):
+    """Write ``source`` repeated ``factor`` times, suffixing keys on each copy.
+
+    PWSID is suffixed in every table, so the copies still join to each other;
+    integer keys are offset instead so they still parse.
+    """
+    key_columns = set(ingest.TABLE_KEYS.get(table_name, ())) | {'PWSID'}
+    with open(source, newline='', encoding='utf-8') as src, \
+            open(target, 'w', newline='', encoding='utf-8') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst, quoting=csv.QUOTE_ALL)
+        header = next(reader)
+        writer.writerow(header)
+        keyed = [(index, ingest.column_type(column) == 'INTEGER')
+                 for index, column in enumerate(header) if column in key_columns]
+        for copy in range(factor):
+            src.seek(0)
+            next(reader)
+            for row in reader:
+                if copy:
+                    for index, integer in keyed:
+                        if index < len(row) and row[index]:
+                            row[index] = (str(int(row[index]) + copy * INTEGER_KEY_OFFSET)
+                                          if integer else f'{row[index]}~{copy}')
+                writer.writerow(row)
+
+
+def scaled_data_dir(data_dir, work_dir, factor):
+    """The bundled data for factor 1, else a synthetic copy ``factor`` times larger"""
+    if factor == 1:
+        return data_dir
+    target_dir = os.path.join(work_dir, f'data_x{factor}')
+    os.makedirs(target_dir, exist_ok=True)
+    for csv_file in ingest.CSV_FILES:
+        source = os.path.join(data_dir, csv_file)
+        target = os.path.join(target_dir, csv_file)
+        if os.path.exists(source) and not os.path.exists(target):
+            print(f"📝 Writing {factor}x {csv_file}")
+            scale_csv(source, target, ingest.table_name_for(csv_file), factor)
+    return target_dir
+
+
+def bench_ingest(data_dir, work_dir, scales, low_memory=False):
+    """Full ingest into a fresh database at each scale"""
+    results = []
+    for factor in scales:
+        source_dir = scaled_data_dir(data_dir, work_dir, factor)
+        database_path = os.path.join(work_dir, f'ingest_x{factor}.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        print(f"⏱️  Ingesting {factor}x data")
+        start = time.perf_counter()
+        stats = ingest.init_database(database_path, source_dir, force=True, low_memory=low_memory)
+        seconds = time.perf_counter() - start
+        rows = sum(table['rows_loaded'] for table in stats)
+        results.append({
+            'scale': factor,
+            'seconds': round(seconds, 3),
+            'rows': rows,
+            'rows_per_sec': round(rows / seconds) if seconds else 0,
+            'database_mb': round(os.path.getsize(database_path) / 1e6, 1),
+            'peak_rss_mb': peak_rss_mb(),
+            'tables': {table['table']: {
+                'rows': table['rows_loaded'],
+                'rejected': table['rejected'],
+                'seconds': table['seconds'],
+                'rows_per_sec': table['rows_per_sec'],
+            } for table in stats},
+        })
+        print(f"✅ {factor}x: {rows:,} rows in {seconds:.2f}s")
+    return results
+
+
+# --- api --------------------------------------------------------------------
+
+def request_mix(database_path):
+    """{label: [path, ...]} for each endpoint, over the largest systems and counties"""
+    conn = sqlite3.connect(database_path)
+    try:
+        pwsids = [row[0] for row in conn.execute(
+            'SELECT PWSID FROM summary_pwsid ORDER BY POPULATION_SERVED_COUNT DESC LIMIT ?',
+            [SAMPLE_SYSTEMS])]
+        counties = [row[0] for row in conn.execute(
+            'SELECT COUNTY_SERVED FROM summary_county ORDER BY system_count DESC LIMIT ?',
+            [SAMPLE_SYSTEMS])]
+    finally:
+        conn.close()
+    return {
+        'water_systems': ['/api/water-systems?limit=50'],
+        'water_systems_county': [f'/api/water-systems?county={quote(c)}' for c in counties],
+        'water_systems_city': ['/api/water-systems?city=Atlanta'],
+        'violations': [f'/api/violations?pwsid={p}' for p in pwsids],
+        'samples': [f'/api/samples?pwsid={p}' for p in pwsids],
+        'samples_decoded': [f'/api/samples?pwsid={p}&decode=1' for p in pwsids],
+        'counties': ['/api/counties'],
+        'search': [f'/api/search?q={quote(c[:4])}' for c in counties],
+        'scorecard': [f'/api/systems/{p}/scorecard' for p in pwsids],
+        'scorecard_batch': ['/api/systems/scorecards?pwsids=' + ','.join(pwsids)],
+        'locate': [f'/api/locate?county={quote(c)}' for c in counties],
+        'codes': ['/api/codes'],
+    }
+
+
+def run_load(flask_app, paths, total, concurrency):
+    """GET ``paths`` round-robin ``total`` times from ``concurrency`` threads"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        client = flask_app.test_client()
+        local = []
+        local_errors = 0
+        for i in counter:
+            start = time.perf_counter()
+            response = client.get(paths[i % len(paths)])
+            response.get_data()
+            local.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latency_summary(latencies, errors[0], time.perf_counter() - start)
+
+
+def bench_api(database_path, requests, concurrency, pool_size):
+    """Per-endpoint latency with the pool on/off (uncached) and with the cache on"""
+    import app
+    import db
+
+    mix = request_mix(database_path)
+    cache_ttl = app.response_cache.ttl
+    modes = [
+        ('pool', pool_size, False),
+        ('no_pool', 0, False),
+        ('pool_cached', pool_size, True),
+    ]
+    results = {}
+    for mode, size, cached in modes:
+        db.init_app(app.app, database_path, size)
+        app.response_cache.clear()
+        # A negative TTL expires every entry on read, so each request runs the view
+        app.response_cache.ttl = cache_ttl if cached else -1
+        print(f"⏱️  API ({mode}, {concurrency} threads)")
+        results[mode] = {}
+        for label, paths in mix.items():
+            run_load(app.app, paths, len(paths), 1)  # warm up
+            summary = run_load(app.app, paths, requests, concurrency)
+            results[mode][label] = summary
+            print(f"  {label}: p50 {summary.get('p50_ms', 0):.2f}ms "
+                  f"p99 {summary.get('p99_ms', 0):.2f}ms, {summary['errors']} errors")
+    app.response_cache.ttl = cache_ttl
+    db.init_app(app.app, database_path, pool_size)
+    return {'concurrency': concurrency, 'requests_per_endpoint': requests,
+            'pool_size': pool_size, 'modes': results}
+
+
+# --- chat -------------------------------------------------------------------
+
+class StubCompletions:
+    """Stands in for ``client.chat.completions``.
+
+    The first (function calling) request asks for ``tool_names``; the
+    follow-up returns a fixed answer, as ``words`` stream chunks when asked.
+    """
+
+    def __init__(self, tool_names, delay=0.0, words=50):
+        self.tool_names = tool_names
+        self.delay = delay
+        self.answer = ' '.join(['water'] * words)
+        self.calls = 0
+
+    def create(self, messages, stream=False, **kwargs):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if 'tool_choice' in kwargs and self.tool_names:
+            tool_calls = [SimpleNamespace(id=f'call_{i}', type='function',
+                                          function=SimpleNamespace(name=name, arguments='{}'))
+                          for i, name in enumerate(self.tool_names)]
+            message = SimpleNamespace(role='assistant', content=None, tool_calls=tool_calls)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        if stream:
+            return (SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + ' '))])
+                    for word in self.answer.split())
+        message = SimpleNamespace(role='assistant', content=self.answer, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def bench_chat(turns, delay, max_tools=3):
+    """Time /api/chat and /api/chat/stream turns against a stub client"""
+    import app
+
+    tool_names = [function['function']['name'] for function in app.FUNCTIONS][:max_tools]
+    original = app.client
+    stub = StubCompletions(tool_names, delay)
+    app.client = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+    client = app.app.test_client()
+    results = {'turns': turns, 'model_delay_s': delay, 'tools': tool_names}
+    try:
+        latencies, errors = [], 0
+        for i in range(turns):
+            client.set_cookie('session_id', f'bench-chat-{i % 4}')
+            start = time.perf_counter()
+            response = client.post('/api/chat', json={'message': CHAT_MESSAGE})
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            # Failures inside the turn still come back as a 200 apology
+            if (response.status_code >= 400
+                    or 'encountered an error' in response.get_json().get('response', '')):
+                errors += 1
+        results['chat'] = latency_summary(latencies, errors)
+
+        latencies, first_frames, errors = [], [], 0
+        for i in range(turns):
+            client.set_cookie('session_id', f'bench-stream-{i % 4}')
+            start = time.perf_counter()
+            response = client.post('/api/chat/stream', json={'message': CHAT_MESSAGE},
+                                   buffered=False)
+            first = None
+            for frame in response.response:
+                if first is None and b'"delta"' in frame:
+                    first = time.perf_counter() - start
+                if b'event: error' in frame:
+                    errors += 1
+            response.close()  # releases the chat slot, as a WSGI server would
+            if response.status_code >= 400:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+            first_frames.append(first if first is not None else latencies[-1])
+        results['stream'] = latency_summary(latencies, errors)
+        results['stream_first_delta'] = latency_summary(first_frames)
+        results['tool_timings'] = app.tool_runner.timings.stats()
+        results['tool_cache'] = app.tool_runner.cache.stats()
+        results['model_calls'] = stub.calls
+    finally:
+        app.client = original
+    print(f"✅ Chat: p50 {results['chat'].get('p50_ms', 0):.2f}ms, "
+          f"stream first delta p50 {results['stream_first_delta'].get('p50_ms', 0):.2f}ms")
+    return results
+
+
+# --- output -----------------------------------------------------------------
+
+def compare(baseline, current):
+    """Print the change in the headline numbers from ``baseline``"""
+    def change(old, new):
+        return f"{old:>10} -> {new:<10} ({(new - old) / old * 100:+.1f}%)" if old else f"-> {new}"
+
+    print(f"\n📊 Compared with {baseline.get('commit')} ({baseline.get('created_at')})")
+    old_ingest = {run['scale']: run for run in baseline.get('ingest', [])}
+    for run in current.get('ingest', []):
+        old = old_ingest.get(run['scale'])
+        if old:
+            print(f"  ingest {run['scale']}x rows/sec {change(old['rows_per_sec'], run['rows_per_sec'])}")
+    old_modes = baseline.get('api', {}).get('modes', {})
+    for mode, endpoints in current.get('api', {}).get('modes', {}).items():
+        for label, summary in endpoints.items():
+            old = old_modes.get(mode, {}).get(label)
+            if old and 'p50_ms' in old and 'p50_ms' in summary:
+                print(f"  {mode} {label} p50 ms {change(old['p50_ms'], summary['p50_ms'])}")
+    for name in ('chat', 'stream'):
+        old = baseline.get('chat', {}).get(name, {})
+        new = current.get('chat', {}).get(name, {})
+        if 'p50_ms' in old and 'p50_ms' in new:
+            print(f"  chat {name} p50 ms {change(old['p50_ms'], new['p50_ms'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingest, API latency and chat')
+    parser.add_argument('--suites', nargs='+', default=['ingest', 'api', 'chat'],
+                        choices=['ingest', 'api', 'chat'])
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10, 100],
+                        help='ingest sizes as multiples of the bundled data')
+    parser.add_argument('--low-memory', action='store_true', help='ingest with --low-memory')
+    parser.add_argument('--database', help='database for the api/chat suites '
+                        '(default: the 1x ingest database, built if needed)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--chat-turns', type=int, default=20)
+    parser.add_argument('--chat-delay', type=float, default=0.0,
+                        help='simulated model latency per completion, in seconds')
+    parser.add_argument('--work-dir', help='scaled data and databases (default: a temp dir)')
+    parser.add_argument('--output', help='results file (default: reports/benchmarks/)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='sdwa-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+    }
+    try:
+        if 'ingest' in args.suites:
+            results['ingest'] = bench_ingest(args.data_dir, work_dir, args.scales, args.low_memory)
+        if 'api' in args.suites or 'chat' in args.suites:
+            database_path = args.database or os.path.join(work_dir, 'ingest_x1.db')
+            if not os.path.exists(database_path):
+                ingest.init_database(database_path, args.data_dir)
+            # app reads its configuration at import time
+            os.environ['DATABASE_PATH'] = database_path
+            os.environ['DB_POOL_SIZE'] = str(args.pool_size)
+            os.environ.setdefault('CHAT_SESSION_DB', os.path.join(work_dir, 'chat_sessions.db'))
+            if 'api' in args.suites:
+                results['api'] = bench_api(database_path, args.requests, args.concurrency,
+                                           args.pool_size)
+            if 'chat' in args.suites:
+                results['chat'] = bench_chat(args.chat_turns, args.chat_delay)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        OUTPUT_DIR, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""In-process caches for read-only API responses.
+
+The SDWA data only changes when an ingest produces a new data version, so GET
+responses are cached by route, normalized query args and data version. ETags
+are derived from the same key, which lets a client revalidate with
+``If-None-Match`` and get a 304 without the route touching the database.
+"""
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+from db import get_data_version
+
+# Query args that select different results; anything else (cache busters,
+# tracking params) is ignored so it cannot fragment the cache
+CACHE_PARAMS = ('county', 'city', 'limit', 'pwsid', 'cursor', 'format', 'decode')
+# Response headers stored with a cached body (pagination links)
+CACHED_HEADERS = ('X-Next-Cursor', 'Link')
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a size bound and per-entry TTL"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'not_modified': self.not_modified,
+            }
+
+
+def cache_key(path, args, params, version):
+    """Route + normalized query args + data version"""
+    normalized = tuple(
+        (name, args.get(name).strip())
+        for name in params
+        if args.get(name, '').strip()
+    )
+    return (path, normalized, version)
+
+
+def cached_response(cache, params=CACHE_PARAMS):
+    """Cache a view's 200 responses and answer conditional requests with 304.
+
+    Responses are not cached until an ingest has recorded a data version.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version, built_at = get_data_version()
+            if version is None:
+                return view(*args, **kwargs)
+
+            key = cache_key(request.path, request.args, params, version)
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+            if request.if_none_match.contains(etag):
+                cache.record_not_modified()
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+            entry = cache.get(key)
+            if entry is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    # Errors and streamed exports are never cached
+                    return response
+                headers = {name: response.headers[name]
+                           for name in CACHED_HEADERS if name in response.headers}
+                entry = (response.get_data(), response.mimetype, headers)
+                cache.set(key, entry)
+
+            body, mimetype, headers = entry
+            response = current_app.response_class(body, mimetype=mimetype, headers=headers)
+            response.set_etag(etag)
+            response.last_modified = built_at
+            response.cache_control.no_cache = True
+            response.headers['X-Data-Version'] = version
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+"""Decoding SDWA reference codes without per-row joins.
+
+``sdwa_ref_code_values`` maps (VALUE_TYPE, VALUE_CODE) to a description for
+codes such as VIOLATION_CODE, CONTAMINANT_CODE and the site-visit eval codes.
+It is small (a few thousand rows), so it is read once per data version into an
+immutable dict and list responses look codes up in memory: ``decode=1`` adds
+a ``<COLUMN>_DESCRIPTION`` next to each code column it recognizes (or a
+``<key>_description`` for lower-case JSON keys mapped onto a code column).
+"""
+import threading
+from types import MappingProxyType
+
+CODES_QUERY = '''
+SELECT VALUE_TYPE, VALUE_CODE, VALUE_DESCRIPTION FROM sdwa_ref_code_values
+'''
+
+DESCRIPTION_SUFFIX = '_DESCRIPTION'
+
+# Columns whose name is not their VALUE_TYPE; any other column named after a
+# VALUE_TYPE (VIOLATION_CODE, UNIT_OF_MEASURE...) decodes as that type
+COLUMN_VALUE_TYPES = {
+    'PWS_ACTIVITY_CODE': 'ACTIVITY_CODE',
+    'FACILITY_ACTIVITY_CODE': 'ACTIVITY_CODE',
+    'MANAGEMENT_OPS_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'SOURCE_WATER_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'SECURITY_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'PUMPS_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'OTHER_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'COMPLIANCE_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'DATA_VERIFICATION_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'TREATMENT_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'FINISHED_WATER_STOR_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'DISTRIBUTION_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+    'FINANCIAL_EVAL_CODE': 'SITE_VISIT_EVAL_TYPE_CODE',
+}
+
+
+def description_key(key):
+    """Where a code's description goes: ``KEY_DESCRIPTION`` or ``key_description``"""
+    return key + (DESCRIPTION_SUFFIX if key.isupper() else DESCRIPTION_SUFFIX.lower())
+
+
+class ReferenceCodes:
+    """Read-only (VALUE_TYPE, VALUE_CODE) -> description, per data version"""
+
+    def __init__(self):
+        self.version = None
+        self.codes = MappingProxyType({})
+        self.value_types = frozenset()
+        self._lock = threading.Lock()
+
+    def is_current(self, version):
+        """True if the table is already loaded for ``version``"""
+        return version == self.version and bool(self.codes)
+
+    def refresh(self, conn, version):
+        """Reload from ``conn`` if the data version changed"""
+        if self.is_current(version):
+            return
+        with self._lock:
+            if self.is_current(version):
+                return
+            codes = {(value_type, code): description
+                     for value_type, code, description in conn.execute(CODES_QUERY)}
+            # Swap in whole objects so readers never see a partial load
+            self.value_types = frozenset(value_type for value_type, _ in codes)
+            self.codes = MappingProxyType(codes)
+            self.version = version
+
+    def value_type(self, column):
+        """The VALUE_TYPE a column holds, or None if it is not a code column"""
+        value_type = COLUMN_VALUE_TYPES.get(column, column)
+        return value_type if value_type in self.value_types else None
+
+    def describe(self, value_type, code):
+        return self.codes.get((value_type, code))
+
+    def by_type(self, value_type=None):
+        """{VALUE_TYPE: {VALUE_CODE: description}}, optionally for one type"""
+        grouped = {}
+        for (code_type, code), description in self.codes.items():
+            if value_type is None or code_type == value_type:
+                grouped.setdefault(code_type, {})[code] = description
+        return grouped
+
+    def row_decoder(self, columns):
+        """(columns + description columns, row -> row + descriptions) for a result set"""
+        decoded = [(index, self.value_type(column)) for index, column in enumerate(columns)]
+        decoded = [(index, value_type) for index, value_type in decoded if value_type]
+        names = list(columns) + [columns[index] + DESCRIPTION_SUFFIX for index, _ in decoded]
+        codes = self.codes
+
+        def decode(row):
+            return tuple(row) + tuple(codes.get((value_type, row[index]))
+                                      for index, value_type in decoded)
+        return names, decode
+
+    def decode_records(self, value, aliases=None):
+        """Add descriptions to every code field of nested dicts/lists (tool results).
+
+        ``aliases`` maps keys that are not column names to the column they
+        hold, e.g. ``{'type': 'PWS_TYPE_CODE'}``.
+        """
+        aliases = aliases or {}
+        if isinstance(value, list):
+            return [self.decode_records(item, aliases) for item in value]
+        if not isinstance(value, dict):
+            return value
+        decoded = {}
+        for key, item in value.items():
+            decoded[key] = self.decode_records(item, aliases)
+            value_type = self.value_type(aliases.get(key, key)) if isinstance(key, str) else None
+            if value_type and isinstance(item, str):
+                description = self.describe(value_type, item)
+                if description is not None:
+                    decoded[description_key(key)] = description
+        return decoded
@@ -0,0 +1,201 @@
+"""SQLite access helpers shared by the Flask routes."""
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from flask import current_app, g
+
+from metrics import TimedConnection
+
+READ_PRAGMAS = [
+    'PRAGMA query_only = ON',
+    'PRAGMA cache_size = -16384',
+    'PRAGMA mmap_size = 268435456',
+]
+
+
+def table_exists(cursor, table_name):
+    """True if ``table_name`` is a table (including a virtual one) in the database"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                   [table_name])
+    return cursor.fetchone() is not None
+
+
+def explain_query_plan(conn, query, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    cursor = conn.execute(f'EXPLAIN QUERY PLAN {query}', params)
+    return [row[3] for row in cursor.fetchall()]
+
+
+def is_table_scan(detail):
+    """True for plan steps that read a whole table rather than an index"""
+    return detail.startswith('SCAN') and 'INDEX' not in detail
+
+
+def check_query_plans(database_path, queries):
+    """EXPLAIN each route's SQL and warn when it falls back to a table scan.
+
+    ``queries`` maps a route label to (sql, params). Returns the labels that
+    scan or fail to plan, so callers can assert on it.
+    """
+    conn = sqlite3.connect(database_path)
+    flagged = []
+    try:
+        for route, (query, params) in queries.items():
+            try:
+                plan = explain_query_plan(conn, query, params)
+            except sqlite3.Error as e:
+                print(f"⚠️  {route}: cannot plan query ({e})")
+                flagged.append(route)
+                continue
+            scans = [detail for detail in plan if is_table_scan(detail)]
+            if scans:
+                print(f"⚠️  {route}: table scan ({'; '.join(scans)})")
+                flagged.append(route)
+    finally:
+        conn.close()
+    return flagged
+
+
+def connect_readonly(database_path, cached_statements=256):
+    """Open a read-only connection with the read PRAGMAs applied"""
+    conn = sqlite3.connect(
+        f'{Path(database_path).resolve().as_uri()}?mode=ro',
+        uri=True,
+        check_same_thread=False,
+        cached_statements=cached_statements,
+        factory=TimedConnection,
+    )
+    for pragma in READ_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of read-only SQLite connections shared across threads.
+
+    Connections are opened lazily up to ``size`` and handed out LIFO, so a
+    quiet server keeps reusing the same warm connection and page cache. Each
+    connection keeps its own prepared-statement cache, which the routes hit
+    because their SQL strings are module constants.
+    """
+
+    def __init__(self, database_path, size=8, cached_statements=256, timeout=5.0):
+        self.database_path = database_path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def connect(self):
+        """Open a new read-only connection"""
+        return connect_readonly(self.database_path, self.cached_statements)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self.connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(f'No database connection free after {self.timeout}s')
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._opened -= 1
+
+
+_pool = None
+
+# How long a looked-up data version is trusted before re-reading summary_meta
+DATA_VERSION_TTL = 5.0
+_data_version = (None, None, 0.0)
+_data_version_lock = threading.Lock()
+
+
+def init_app(app, database_path, pool_size=8):
+    """Serve ``get_db`` connections from a pool; ``pool_size=0`` disables it.
+
+    Without the pool every request opens and closes its own connection, which
+    is the baseline to compare latency against.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+    _pool = ConnectionPool(database_path, size=pool_size) if pool_size > 0 else None
+    app.config['DATABASE_PATH'] = database_path
+    if release_db not in app.teardown_appcontext_funcs:
+        app.teardown_appcontext(release_db)
+
+
+def get_db():
+    """Connection bound to the current Flask app context"""
+    if 'db' not in g:
+        if _pool is not None:
+            g.db = _pool.acquire()
+        else:
+            g.db = sqlite3.connect(current_app.config['DATABASE_PATH'], factory=TimedConnection)
+    return g.db
+
+
+def release_db(exc=None):
+    """Hand the app context's connection back early (also the teardown hook).
+
+    Long-lived contexts such as a chat turn or an SSE stream call this once
+    they are done reading, so they don't hold a pooled connection while
+    waiting on the model.
+    """
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if _pool is not None:
+        _pool.release(conn)
+    else:
+        conn.close()
+
+
+def get_data_version():
+    """(data_version, built_at) of the loaded data, or (None, None).
+
+    Read from ``summary_meta`` and memoized for DATA_VERSION_TTL seconds so
+    per-request callers do not each pay a query.
+    """
+    global _data_version
+    version, built_at, checked = _data_version
+    if time.monotonic() - checked < DATA_VERSION_TTL:
+        return version, built_at
+    with _data_version_lock:
+        try:
+            row = get_db().execute(
+                'SELECT data_version, built_at FROM summary_meta').fetchone()
+        except sqlite3.Error:
+            row = None
+        if row:
+            version = row[0]
+            built_at = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        else:
+            version, built_at = None, None
+        _data_version = (version, built_at, time.monotonic())
+    return version, built_at
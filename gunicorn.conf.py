@@ -0,0 +1,41 @@
+"""Production serving for the Flask app.
+
+    pip install gunicorn
+    python ingest.py                      # or INGEST_ON_START=1
+    gunicorn -c gunicorn.conf.py app:app
+
+Several worker processes each run a pool of threads (gthread). A chat turn
+blocks its thread while the model answers, so app.py caps concurrent turns
+per process (CHAT_MAX_CONCURRENCY, default 4); the remaining threads keep
+serving the GET routes. Keep WEB_THREADS well above that cap.
+
+Every worker reads the same SQLite file through its own pool of read-only
+connections. The database is in WAL mode, so an ingest can run alongside
+the server: readers keep seeing the previous data until the ingest commits,
+and caches switch over once the new data version is picked up. Chat history
+lives in its own WAL database (CHAT_SESSION_DB) shared by all workers.
+
+The connection pool defaults to WEB_THREADS + TOOL_WORKERS connections per
+worker (app.py reads the same WEB_THREADS); if you set DB_POOL_SIZE by hand,
+keep it at least that large.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', str(min(multiprocessing.cpu_count(), 4))))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '16'))
+# A chat turn is two model calls plus tools; streaming responses stay open longer
+timeout = int(os.getenv('WEB_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.getenv('ACCESS_LOG', '-')
+
+
+def on_starting(server):
+    """Optionally load changed CSVs once, before any worker starts"""
+    if os.getenv('INGEST_ON_START') == '1':
+        import ingest
+        server.log.info('Refreshing database...')
+        ingest.init_database(os.getenv('DATABASE_PATH', './water_quality.db'))
@@ -0,0 +1,541 @@
+"""Bulk CSV ingest for the SDWA tables.
+
+Each CSV is parsed once, converted to typed values (ISO dates, INTEGER counts,
+REAL measures) and written with batched ``executemany`` inside a single
+transaction, so a reader never sees a half-loaded database.
+
+An ``ingest_manifest`` table records the hash, size, mtime and submission
+quarter of every loaded file. A refresh skips files that have not changed and
+upserts the rest by natural key, so it can run while the app is serving.
+"""
+import argparse
+import csv
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from itertools import islice
+
+import scorecards
+import search
+import summaries
+
+DATA_DIR = os.getenv('DATA_DIR', '../data')
+DATABASE_PATH = os.getenv('DATABASE_PATH', './water_quality.db')
+
+BATCH_SIZE = 5000
+
+CSV_FILES = [
+    'SDWA_PUB_WATER_SYSTEMS.csv',
+    'SDWA_VIOLATIONS_ENFORCEMENT.csv',
+    'SDWA_LCR_SAMPLES.csv',
+    'SDWA_FACILITIES.csv',
+    'SDWA_SITE_VISITS.csv',
+    'SDWA_GEOGRAPHIC_AREAS.csv',
+    'SDWA_EVENTS_MILESTONES.csv',
+    'SDWA_SERVICE_AREAS.csv',
+    'SDWA_PN_VIOLATION_ASSOC.csv',
+    'SDWA_REF_CODE_VALUES.csv'
+]
+
+# Natural keys from the data dictionary. SUBMISSIONYEARQUARTER is left out so
+# a new quarterly snapshot updates rows in place instead of accumulating.
+TABLE_KEYS = {
+    'sdwa_pub_water_systems': ('PWSID',),
+    'sdwa_violations_enforcement': ('PWSID', 'VIOLATION_ID', 'ENFORCEMENT_ID'),
+    'sdwa_lcr_samples': ('PWSID', 'SAMPLE_ID', 'SAR_ID'),
+    'sdwa_facilities': ('PWSID', 'FACILITY_ID'),
+    'sdwa_site_visits': ('PWSID', 'VISIT_ID'),
+    'sdwa_geographic_areas': ('PWSID', 'GEO_ID'),
+    'sdwa_events_milestones': ('PWSID', 'EVENT_SCHEDULE_ID'),
+    'sdwa_service_areas': ('PWSID', 'SERVICE_AREA_TYPE_CODE'),
+    'sdwa_pn_violation_assoc': ('PWSID', 'PN_VIOLATION_ID', 'RELATED_VIOLATION_ID'),
+    'sdwa_ref_code_values': ('VALUE_TYPE', 'VALUE_CODE'),
+}
+
+MANIFEST_SQL = '''
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+    table_name TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    submission_quarter TEXT,
+    row_count INTEGER NOT NULL,
+    rejected INTEGER NOT NULL,
+    loaded_at TEXT NOT NULL
+)
+'''
+
+# Column types follow the SDWIS data dictionary (data/README.md). Codes such
+# as EPA_REGION or VIOLATION_CODE carry leading zeros and stay TEXT.
+INTEGER_COLUMNS = {
+    'POPULATION_SERVED_COUNT',
+    'SERVICE_CONNECTIONS_COUNT',
+    'SEVERITY_IND_CNT',
+    'PUBLIC_NOTIFICATION_TIER',
+    'CALCULATED_PUB_NOTIF_TIER',
+    'SAR_ID',
+}
+REAL_COLUMNS = {
+    'SAMPLE_MEASURE',
+    'VIOL_MEASURE',
+    'STATE_MCL',
+}
+# *_DATE columns that are not MM/DD/YYYY dates (seasonal DD-MON strings)
+NON_DATE_COLUMNS = {'SEASON_BEGIN_DATE', 'SEASON_END_DATE'}
+
+# SDWIS marks open-ended periods with an arrow instead of an end date
+OPEN_ENDED_DATE = '--->'
+_DATE_RE = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+
+# Indexes owned by the ingest step, created after every load. Any idx_*
+# index not listed here, or defined differently, is dropped (and recreated)
+# so the set stays in sync with the routes. The list routes order by
+# (sort column DESC, rowid DESC); an ascending index read backwards gives
+# exactly that order because rowid is the implicit last key, so their sort
+# columns are deliberately not declared DESC.
+MANAGED_INDEXES = {
+    'idx_violations_pwsid_begin': (
+        'sdwa_violations_enforcement', ('PWSID', 'NON_COMPL_PER_BEGIN_DATE')),
+    'idx_lcr_samples_pwsid_end': (
+        'sdwa_lcr_samples', ('PWSID', 'SAMPLING_END_DATE')),
+    'idx_geo_area_county_pwsid': (
+        'sdwa_geographic_areas', ('AREA_TYPE_CODE', 'COUNTY_SERVED', 'PWSID')),
+    'idx_geo_pwsid_area': (
+        'sdwa_geographic_areas', ('PWSID', 'AREA_TYPE_CODE', 'COUNTY_SERVED')),
+    'idx_pws_activity_population': (
+        'sdwa_pub_water_systems', ('PWS_ACTIVITY_CODE', 'POPULATION_SERVED_COUNT')),
+}
+
+LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA temp_store = MEMORY',
+]
+# For exports far larger than RAM: staging tables and sorts spill to temp
+# files and the page cache is capped, so memory stays flat as input grows
+LOW_MEMORY_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16384',
+    'PRAGMA temp_store = FILE',
+]
+
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines for long loads
+
+
+def table_name_for(csv_file):
+    """Map a CSV file name to its SQLite table name"""
+    return csv_file.replace('.csv', '').lower()
+
+
+def column_type(column):
+    """Return the storage type for a column: INTEGER, REAL, DATE or TEXT"""
+    if column in INTEGER_COLUMNS:
+        return 'INTEGER'
+    if column in REAL_COLUMNS:
+        return 'REAL'
+    if column.endswith('_DATE') and column not in NON_DATE_COLUMNS:
+        return 'DATE'
+    return 'TEXT'
+
+
+def to_iso_date(value):
+    """Convert an SDWIS MM/DD/YYYY date to ISO YYYY-MM-DD"""
+    if value == OPEN_ENDED_DATE:
+        return None
+    match = _DATE_RE.fullmatch(value)
+    if not match:
+        raise ValueError(f'invalid date {value!r}')
+    month, day, year = match.groups()
+    return f'{year}-{month}-{day}'
+
+
+_CONVERTERS = {
+    'INTEGER': int,
+    'REAL': float,
+    'DATE': to_iso_date,
+    'TEXT': str,
+}
+
+
+def _nullable(convert):
+    def convert_or_null(value):
+        return convert(value) if value != '' else None
+    return convert_or_null
+
+
+def row_converters(headers, key_columns=()):
+    """Per-column converters for a CSV header.
+
+    Blank cells become NULL, except in natural-key columns where a blank TEXT
+    value is kept as '' so the key stays usable in a UNIQUE index.
+    """
+    converters = []
+    for col in headers:
+        convert = _CONVERTERS[column_type(col)]
+        converters.append(convert if col in key_columns else _nullable(convert))
+    return converters
+
+
+def convert_row(row, converters):
+    """Convert one CSV row to typed values"""
+    return tuple(convert(value) for convert, value in zip(converters, row))
+
+
+def create_table_sql(table_name, headers, key_columns=()):
+    """CREATE TABLE statement for a CSV header; dates are stored as ISO TEXT"""
+    columns = []
+    for col in headers:
+        sql_type = column_type(col)
+        not_null = ' NOT NULL' if col in key_columns else ''
+        columns.append(f'"{col}" {"TEXT" if sql_type == "DATE" else sql_type}{not_null}')
+    if key_columns:
+        columns.append(f'UNIQUE ({_column_list(key_columns)})')
+    return f'CREATE TABLE {table_name} ({", ".join(columns)})'
+
+
+def _column_list(columns, prefix=''):
+    return ', '.join(f'{prefix}"{col}"' for col in columns)
+
+
+def apply_pragmas(conn, pragmas=LOAD_PRAGMAS):
+    for pragma in pragmas:
+        conn.execute(pragma)
+
+
+def table_columns(cursor, table_name):
+    """Column names of an existing table, or [] if it does not exist"""
+    return [row[1] for row in cursor.execute(f'PRAGMA table_info({table_name})')]
+
+
+def needs_rebuild(cursor, table_name, headers, key_columns):
+    """True unless ``table_name`` is exactly what ``create_table_sql`` would make.
+
+    Tables from older loaders (no manifest row, all-TEXT columns, or no UNIQUE
+    index on the natural key) cannot take the keyed upsert and are recreated.
+    """
+    info = list(cursor.execute(f'PRAGMA table_info({table_name})'))
+    if [row[1] for row in info] != headers:
+        return True
+    cursor.execute('SELECT 1 FROM ingest_manifest WHERE table_name = ?', (table_name,))
+    if cursor.fetchone() is None:
+        return True
+    declared = {row[1]: row[2].upper() for row in info}
+    for col in headers:
+        sql_type = column_type(col)
+        if declared[col] != ('TEXT' if sql_type == 'DATE' else sql_type):
+            return True
+    if not key_columns:
+        return False
+    for index in list(cursor.execute(f'PRAGMA index_list({table_name})')):
+        name, unique, partial = index[1], index[2], index[4]
+        if unique and not partial:
+            indexed = [row[2] for row in cursor.execute(f'PRAGMA index_info("{name}")')]
+            if sorted(indexed) == sorted(key_columns):
+                return False
+    return True
+
+
+def iter_typed_rows(csv_reader, headers, converters, stats):
+    """Yield typed rows, counting rejected rows by reason in ``stats``"""
+    width = len(headers)
+    rejected = stats['rejected_reasons']
+    for row in csv_reader:
+        stats['rows_read'] += 1
+        if len(row) != width:
+            rejected['column_count'] = rejected.get('column_count', 0) + 1
+            continue
+        try:
+            yield convert_row(row, converters)
+        except ValueError:
+            # Find the offending column so the report says what to fix
+            for col, convert, value in zip(headers, converters, row):
+                try:
+                    convert(value)
+                except ValueError:
+                    reason = f'bad_value:{col}'
+                    rejected[reason] = rejected.get(reason, 0) + 1
+                    break
+
+
+def load_csv(cursor, file_path, table_name, batch_size=BATCH_SIZE):
+    """Load one CSV into the staging table ``temp.stage_<table_name>``.
+
+    Rows are streamed, converted and written with batched executemany, so
+    only one batch is held in Python at a time; progress is printed every
+    PROGRESS_INTERVAL seconds. Returns a stats dict with the header, rows
+    loaded and rejected-row counts by reason. The caller owns the transaction
+    and merges the stage with ``merge_stage``.
+    """
+    stats = {
+        'table': table_name,
+        'file': os.path.basename(file_path),
+        'rows_read': 0,
+        'rows_loaded': 0,
+        'rejected': 0,
+        'rejected_reasons': {},
+        'started': time.perf_counter(),
+    }
+    key_columns = TABLE_KEYS.get(table_name, ())
+    stage = f'stage_{table_name}'
+    file_size = os.path.getsize(file_path) or 1
+    next_report = stats['started'] + PROGRESS_INTERVAL
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        csv_reader = csv.reader(f)
+        headers = next(csv_reader)
+        stats['columns'] = headers
+
+        cursor.execute(f'DROP TABLE IF EXISTS temp.{stage}')
+        cursor.execute(create_table_sql(f'temp.{stage}', headers))
+
+        placeholders = ', '.join('?' for _ in headers)
+        insert_sql = f'INSERT INTO temp.{stage} VALUES ({placeholders})'
+        converters = row_converters(headers, key_columns)
+        rows = iter_typed_rows(csv_reader, headers, converters, stats)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(insert_sql, batch)
+            stats['rows_loaded'] += len(batch)
+            if time.perf_counter() >= next_report:
+                done = f.buffer.tell() / file_size
+                print(f"  … {table_name}: {stats['rows_read']:,} rows ({done:.0%})")
+                next_report = time.perf_counter() + PROGRESS_INTERVAL
+
+    if 'SUBMISSIONYEARQUARTER' in headers:
+        cursor.execute(f'SELECT MAX(SUBMISSIONYEARQUARTER) FROM temp.{stage}')
+        stats['submission_quarter'] = cursor.fetchone()[0]
+    return stats
+
+
+def merge_stage(cursor, table_name, stats):
+    """Upsert the staged rows into ``table_name`` by natural key.
+
+    Only rows whose values changed are rewritten, and rows missing from the
+    new file are deleted. A table whose columns, column types or key index
+    changed, or that an older loader created, is rebuilt.
+    """
+    headers = stats['columns']
+    stage = f'temp.stage_{table_name}'
+    key_columns = [col for col in TABLE_KEYS.get(table_name, ()) if col in headers]
+    if needs_rebuild(cursor, table_name, headers, key_columns):
+        cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+        cursor.execute(create_table_sql(table_name, headers, key_columns))
+    if not key_columns:
+        # No natural key: replace the contents wholesale
+        cursor.execute(f'DELETE FROM {table_name}')
+        stats['deleted'] = cursor.rowcount
+        cursor.execute(f'INSERT INTO {table_name} SELECT * FROM {stage}')
+        stats.update(inserted=cursor.rowcount, updated=0)
+        return stats
+
+    keys = _column_list(key_columns)
+    cursor.execute(f'CREATE INDEX temp.ix_stage_{table_name} ON stage_{table_name} ({keys})')
+    cursor.execute(f'SELECT COUNT(*) FROM (SELECT DISTINCT {keys} FROM {stage})')
+    duplicates = stats['rows_loaded'] - cursor.fetchone()[0]
+    if duplicates:
+        # Later rows win in the upsert; report the earlier ones as rejected
+        stats['rejected_reasons']['duplicate_key'] = duplicates
+        stats['rows_loaded'] -= duplicates
+
+    cursor.execute(f'SELECT COUNT(*) FROM {table_name}')
+    before = cursor.fetchone()[0]
+    columns = _column_list(headers)
+    value_columns = [col for col in headers if col not in key_columns]
+    if value_columns:
+        assignments = ', '.join(f'"{col}" = excluded."{col}"' for col in value_columns)
+        changed = ' OR '.join(f'{table_name}."{col}" IS NOT excluded."{col}"'
+                              for col in value_columns)
+        on_conflict = f'DO UPDATE SET {assignments} WHERE {changed}'
+    else:
+        on_conflict = 'DO NOTHING'
+    cursor.execute(f'''
+        INSERT INTO {table_name} ({columns})
+        SELECT {columns} FROM {stage} WHERE true
+        ON CONFLICT ({keys}) {on_conflict}
+    ''')
+    upserted = cursor.rowcount
+    cursor.execute(f'SELECT COUNT(*) FROM {table_name}')
+    stats['inserted'] = cursor.fetchone()[0] - before
+    stats['updated'] = upserted - stats['inserted']
+
+    match = ' AND '.join(f's."{col}" = {table_name}."{col}"' for col in key_columns)
+    cursor.execute(f'''
+        DELETE FROM {table_name}
+        WHERE NOT EXISTS (SELECT 1 FROM {stage} s WHERE {match})
+    ''')
+    stats['deleted'] = cursor.rowcount
+    cursor.execute(f'DROP TABLE {stage}')
+    return stats
+
+
+def file_fingerprint(file_path, previous=None):
+    """Size, mtime and SHA-256 of a file.
+
+    The hash is reused from ``previous`` (a manifest row) when size and mtime
+    are unchanged, so an unchanged refresh only stats the files.
+    """
+    st = os.stat(file_path)
+    fingerprint = {'size': st.st_size, 'mtime': st.st_mtime}
+    if previous and previous['size'] == st.st_size and previous['mtime'] == st.st_mtime:
+        fingerprint['sha256'] = previous['sha256']
+        return fingerprint
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+
+def read_manifest(cursor):
+    """Manifest rows keyed by table name"""
+    cursor.execute(MANIFEST_SQL)
+    cursor.execute('''
+        SELECT table_name, file_name, sha256, size, mtime, submission_quarter,
+               row_count, rejected, loaded_at
+        FROM ingest_manifest
+    ''')
+    columns = [description[0] for description in cursor.description]
+    return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+
+def write_manifest(cursor, table_name, file_name, fingerprint, stats=None):
+    """Record a loaded file; without ``stats`` only the size/mtime are refreshed"""
+    if stats is None:
+        cursor.execute(
+            'UPDATE ingest_manifest SET size = ?, mtime = ? WHERE table_name = ?',
+            [fingerprint['size'], fingerprint['mtime'], table_name])
+        return
+    cursor.execute('''
+        INSERT OR REPLACE INTO ingest_manifest
+            (table_name, file_name, sha256, size, mtime, submission_quarter,
+             row_count, rejected, loaded_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [table_name, file_name, fingerprint['sha256'], fingerprint['size'],
+          fingerprint['mtime'], stats.get('submission_quarter'), stats['rows_loaded'],
+          stats['rejected'], datetime.now().isoformat(timespec='seconds')])
+
+
+def ensure_indexes(cursor, indexes=MANAGED_INDEXES):
+    """Create missing managed indexes and drop stale or redefined ones.
+
+    Indexes on tables that were not loaded are skipped. Returns the number of
+    indexes created or dropped.
+    """
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name GLOB 'idx_*'")
+    existing = dict(cursor.fetchall())
+    wanted = {name: f'CREATE INDEX {name} ON {table_name} ({", ".join(columns)})'
+              for name, (table_name, columns) in indexes.items()}
+    changed = 0
+    for name, sql in existing.items():
+        if wanted.get(name) != sql:
+            cursor.execute(f'DROP INDEX {name}')
+            changed += 1
+    for name, (table_name, columns) in indexes.items():
+        if existing.get(name) == wanted[name]:
+            continue
+        required = {col.split()[0] for col in columns}
+        if not required <= set(table_columns(cursor, table_name)):
+            continue
+        cursor.execute(wanted[name])
+        changed += 1
+    return changed
+
+
+def print_load_stats(stats):
+    print(f"Loaded {stats['file']} into {stats['table']} table: "
+          f"{stats['rows_loaded']:,} rows in {stats['seconds']:.2f}s "
+          f"({stats['rows_per_sec']:,} rows/sec), {stats['rejected']:,} rejected; "
+          f"{stats['inserted']:,} inserted, {stats['updated']:,} updated, "
+          f"{stats['deleted']:,} deleted")
+    for reason, count in sorted(stats['rejected_reasons'].items()):
+        print(f"  - rejected {count:,} rows: {reason}")
+
+
+def init_database(database_path=DATABASE_PATH, data_dir=DATA_DIR, force=False,
+                  low_memory=False, batch_size=BATCH_SIZE):
+    """Load or refresh the SDWA tables from the CSVs in ``data_dir``.
+
+    Files whose hash matches the ingest manifest are skipped unless ``force``
+    is set; changed files are upserted by natural key. Everything runs in one
+    WAL transaction, so the app can keep serving reads during a refresh.
+    ``low_memory`` keeps staging data on disk for very large exports.
+    Returns the stats dicts of the files that were (re)loaded.
+    """
+    conn = sqlite3.connect(database_path, isolation_level=None)
+    apply_pragmas(conn, LOW_MEMORY_PRAGMAS if low_memory else LOAD_PRAGMAS)
+    cursor = conn.cursor()
+    manifest = read_manifest(cursor)
+
+    pending = []
+    for csv_file in CSV_FILES:
+        file_path = os.path.join(data_dir, csv_file)
+        if not os.path.exists(file_path):
+            print(f"Skipping {csv_file}: not found in {data_dir}")
+            continue
+        table_name = table_name_for(csv_file)
+        previous = manifest.get(table_name)
+        fingerprint = file_fingerprint(file_path, previous)
+        unchanged = (previous is not None
+                     and previous['sha256'] == fingerprint['sha256']
+                     and table_columns(cursor, table_name))
+        pending.append((csv_file, file_path, table_name, fingerprint,
+                        unchanged and not force))
+
+    all_stats = []
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        for csv_file, file_path, table_name, fingerprint, unchanged in pending:
+            if unchanged:
+                write_manifest(cursor, table_name, csv_file, fingerprint)
+                print(f"Skipping {csv_file}: unchanged since last load")
+                continue
+            stats = load_csv(cursor, file_path, table_name, batch_size)
+            merge_stage(cursor, table_name, stats)
+            elapsed = time.perf_counter() - stats.pop('started')
+            stats['rejected'] = sum(stats['rejected_reasons'].values())
+            stats['seconds'] = round(elapsed, 3)
+            stats['rows_per_sec'] = round(stats['rows_loaded'] / elapsed) if elapsed else 0
+            write_manifest(cursor, table_name, csv_file, fingerprint, stats)
+            print_load_stats(stats)
+            all_stats.append(stats)
+        indexes_changed = ensure_indexes(cursor)
+        version = summaries.data_version(cursor)
+        summaries_rebuilt = summaries.refresh_summaries(cursor, version, force=force)
+        if summaries_rebuilt:
+            print(f"Rebuilt summary tables for data version {version}")
+        if search.refresh_search_index(cursor, rebuild=summaries_rebuilt):
+            print("Rebuilt search index")
+        if scorecards.refresh_scorecards(cursor, rebuild=summaries_rebuilt):
+            print("Rebuilt system scorecards")
+        if indexes_changed or summaries_rebuilt or all_stats:
+            # Refresh planner statistics for the new data and indexes
+            cursor.execute('ANALYZE')
+        cursor.execute('COMMIT')
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return all_stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load or refresh the SDWA SQLite database')
+    parser.add_argument('--database', default=DATABASE_PATH)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--force', action='store_true',
+                        help='reload every file even if the manifest says it is unchanged')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='stage on disk with a small cache, for exports larger than RAM')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    init_database(args.database, args.data_dir, force=args.force,
+                  low_memory=args.low_memory, batch_size=args.batch_size)
@@ -0,0 +1,258 @@
+"""In-memory "who serves me" lookup by ZIP, city, county or coordinates.
+
+The index is built from ``sdwa_geographic_areas`` (ZIP_CODE_SERVED,
+CITY_SERVED, COUNTY_SERVED), the systems' own address ZIPs and the
+per-system violation counts in ``summary_pwsid``, and is rebuilt when the
+data version changes. Coordinates are resolved through a local centroid file,
+a CSV with one row per place::
+
+    kind,name,state,lat,lon
+    zip,30303,GA,33.7525,-84.3915
+    city,ATLANTA,GA,33.7490,-84.3880
+    county,Fulton,GA,33.7900,-84.4700
+
+Centroids go into a uniform lat/lon grid so a radius query only looks at the
+cells around the point. Without a centroid file, ZIP, city and county lookups
+still work; coordinate lookups report that no centroids are loaded.
+"""
+import csv
+import math
+import os
+import threading
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+GRID_CELL_DEGREES = 0.1  # ~11 km cells
+DEFAULT_RADIUS_KM = 10.0
+MAX_RADIUS_KM = 100.0
+PLACE_KINDS = ('zip', 'city', 'county')
+# Result keys holding reference codes, for codes.ReferenceCodes.decode_records
+CODE_COLUMNS = {'type': 'PWS_TYPE_CODE'}
+
+SYSTEMS_QUERY = '''
+SELECT PWSID, PWS_NAME, PWS_TYPE_CODE, POPULATION_SERVED_COUNT,
+       health_violation_count, open_health_violation_count
+FROM summary_pwsid
+WHERE PWS_ACTIVITY_CODE = 'A'
+'''
+
+AREAS_QUERY = '''
+SELECT PWSID, AREA_TYPE_CODE, ZIP_CODE_SERVED, CITY_SERVED, COUNTY_SERVED
+FROM sdwa_geographic_areas
+'''
+
+ADDRESS_ZIP_QUERY = '''
+SELECT PWSID, substr(ZIP_CODE, 1, 5) FROM sdwa_pub_water_systems WHERE ZIP_CODE IS NOT NULL
+'''
+
+
+class CentroidsUnavailable(Exception):
+    """Raised for a coordinate lookup when no centroid file is loaded"""
+
+
+def place_key(name):
+    """Case- and whitespace-insensitive key for city/county/ZIP names"""
+    return ' '.join(str(name).split()).upper()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """Points bucketed into fixed-size lat/lon cells for radius queries"""
+
+    def __init__(self, cell_degrees=GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self.size = 0
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def add(self, lat, lon, item):
+        self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, item))
+        self.size += 1
+
+    def within(self, lat, lon, radius_km):
+        """[(distance_km, item), ...] within ``radius_km``, nearest first"""
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self._cell(lat - lat_span, lon - lon_span)
+        max_row, max_col = self._cell(lat + lat_span, lon + lon_span)
+        matches = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for point_lat, point_lon, item in self._cells.get((row, col), ()):
+                    distance = haversine_km(lat, lon, point_lat, point_lon)
+                    if distance <= radius_km:
+                        matches.append((distance, item))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+def load_centroids(path):
+    """{(kind, key): (lat, lon, name)} from a centroid CSV; {} if it is missing"""
+    centroids = {}
+    if not path or not os.path.exists(path):
+        return centroids
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            kind = (row.get('kind') or '').strip().lower()
+            if kind not in PLACE_KINDS:
+                continue
+            try:
+                lat, lon = float(row['lat']), float(row['lon'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            centroids[(kind, place_key(row['name']))] = (lat, lon, row['name'].strip())
+    return centroids
+
+
+class Places:
+    """PWSIDs by ZIP, city and county, plus a grid of place centroids.
+
+    Built once by ``load`` and never modified afterwards, so any number of
+    threads can read one while a newer one is being built.
+    """
+
+    def __init__(self, systems=None, places=None, address_zips=None, centroids=None, grid=None):
+        self.systems = systems or {}
+        self.places = places or {kind: {} for kind in PLACE_KINDS}
+        self.address_zips = address_zips or {}
+        self.centroids = centroids or {}
+        self.grid = grid or GridIndex()
+
+    @classmethod
+    def load(cls, conn, centroids_path=None):
+        """Build from ``conn`` and the optional centroid CSV"""
+        systems = {}
+        for pwsid, name, type_code, population, health, open_health in conn.execute(SYSTEMS_QUERY):
+            systems[pwsid] = {
+                'pwsid': pwsid,
+                'name': name,
+                'type': type_code,
+                'population_served': population,
+                'health_violations': health,
+                'open_health_violations': open_health,
+            }
+        places = {kind: {} for kind in PLACE_KINDS}
+        for pwsid, area_type, zip_code, city, county in conn.execute(AREAS_QUERY):
+            for kind, name in (('zip', zip_code), ('city', city), ('county', county)):
+                if name:
+                    entry = places[kind].setdefault(place_key(name), (name, set()))
+                    entry[1].add(pwsid)
+        address_zips = {}
+        for pwsid, zip_code in conn.execute(ADDRESS_ZIP_QUERY):
+            address_zips.setdefault(zip_code, set()).add(pwsid)
+
+        centroids = load_centroids(centroids_path)
+        grid = GridIndex()
+        for (kind, key), (lat, lon, name) in centroids.items():
+            # Only places some system serves; a ZIP may be known just from
+            # the systems' own address ZIPs
+            if key in places[kind] or (kind == 'zip' and key in address_zips):
+                grid.add(lat, lon, (kind, key))
+        return cls(systems, places, address_zips, centroids, grid)
+
+    def _systems(self, matches):
+        """Active systems for [(pwsid, matched_by), ...], largest first"""
+        systems = {}
+        for pwsid, matched_by in matches:
+            system = self.systems.get(pwsid)
+            if system is None:
+                continue
+            entry = systems.setdefault(pwsid, dict(system, matched_by=[]))
+            if matched_by not in entry['matched_by']:
+                entry['matched_by'].append(matched_by)
+        return sorted(systems.values(),
+                      key=lambda system: system['population_served'] or 0, reverse=True)
+
+    def _place_name(self, kind, key):
+        return self.places[kind].get(key, (key,))[0]
+
+    def _place_matches(self, places):
+        """[(pwsid, matched_by), ...] for [(kind, key), ...], address ZIPs included"""
+        matches = []
+        for kind, key in places:
+            if key in self.places[kind]:
+                name, pwsids = self.places[kind][key]
+                matches += [(pwsid, f'{kind}:{name}') for pwsid in pwsids]
+            if kind == 'zip':
+                matches += [(pwsid, f'address_zip:{key}')
+                            for pwsid in self.address_zips.get(key, ())]
+        return matches
+
+    def by_name(self, kind, name):
+        """Systems serving a named ZIP, city or county"""
+        key = place_key(name)
+        places = [(kind, key)] if key in self.places[kind] else []
+        return {
+            'places': [{'kind': kind, 'name': self._place_name(kind, key)} for kind, key in places],
+            'systems': self._systems(self._place_matches([(kind, key)])),
+        }
+
+    def by_point(self, lat, lon, radius_km=DEFAULT_RADIUS_KM):
+        """Systems serving the ZIPs, cities and counties whose centroids are nearby.
+
+        Raises CentroidsUnavailable when no centroid file is loaded.
+        """
+        if not self.grid.size:
+            raise CentroidsUnavailable('No place centroids loaded; set GEO_CENTROIDS_PATH')
+        nearby = self.grid.within(lat, lon, radius_km)
+        places = [place for _, place in nearby]
+        return {
+            'places': [{'kind': kind, 'name': self._place_name(kind, key),
+                        'distance_km': round(distance, 2)}
+                       for distance, (kind, key) in nearby],
+            'systems': self._systems(self._place_matches(places)),
+        }
+
+    def by_zip(self, zip_code, radius_km=DEFAULT_RADIUS_KM):
+        """ZIP_CODE_SERVED and address matches, then places near the ZIP centroid"""
+        key = place_key(zip_code)[:5]
+        result = self.by_name('zip', key)
+        centroid = self.centroids.get(('zip', key))
+        if centroid and self.grid.size:
+            nearby = self.by_point(centroid[0], centroid[1], radius_km)
+            result['places'] += [place for place in nearby['places']
+                                 if (place['kind'], place['name']) != ('zip', key)]
+            result['systems'] = self._systems(
+                [(system['pwsid'], matched_by)
+                 for system in result['systems'] + nearby['systems']
+                 for matched_by in system['matched_by']])
+        return result
+
+
+class PlaceIndex:
+    """The current ``Places``, rebuilt when the data version changes"""
+
+    def __init__(self, centroids_path=None):
+        self.centroids_path = centroids_path
+        self.version = None
+        self.current = Places()
+        self._lock = threading.Lock()
+
+    def refresh(self, conn, version):
+        """Rebuild from ``conn`` if the data version changed"""
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            # Build aside and swap in one assignment so readers never see a
+            # partial index; each lookup works on the Places it started with
+            self.current = Places.load(conn, self.centroids_path)
+            self.version = version
+
+    def by_name(self, kind, name):
+        return self.current.by_name(kind, name)
+
+    def by_point(self, lat, lon, radius_km=DEFAULT_RADIUS_KM):
+        return self.current.by_point(lat, lon, radius_km)
+
+    def by_zip(self, zip_code, radius_km=DEFAULT_RADIUS_KM):
+        return self.current.by_zip(zip_code, radius_km)
@@ -0,0 +1,277 @@
+"""Request instrumentation exposed in the Prometheus text format.
+
+``init_app`` times every request per route and splits it into SQL time
+(measured in the cursor, execute plus fetches) and JSON serialization time,
+and counts rows fetched. Chat code reports OpenAI latency and token usage
+through ``record_completion``. Everything is served from /api/metrics.
+
+Connections opened with ``factory=TimedConnection`` feed the SQL numbers.
+With a slow-query threshold set, a statement that takes longer is printed
+once with its EXPLAIN QUERY PLAN and kept in a short in-memory log.
+"""
+import bisect
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import g, has_app_context, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+OPENAI_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+SLOW_QUERY_LOG_SIZE = 100
+
+_slow_query_seconds = None  # None disables the slow-query log
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values, as Prometheus expects"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {self.sum:.6f}')
+        lines.append(f'{name}_count{_labels(labels)} {self.count}')
+        return lines
+
+
+class Registry:
+    """Thread-safe counters and histograms keyed by name and label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        self.update(counters=[(name, amount, labels)])
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        self.update(histograms=[(name, value, buckets, labels)])
+
+    def update(self, counters=(), histograms=()):
+        """Apply several (name, amount, labels) and (name, value, buckets, labels)
+        updates under one lock acquisition"""
+        counters = [((name, tuple(sorted(labels.items()))), amount)
+                    for name, amount, labels in counters]
+        histograms = [((name, tuple(sorted(labels.items()))), value, buckets)
+                      for name, value, buckets, labels in histograms]
+        with self._lock:
+            for key, amount in counters:
+                self._counters[key] = self._counters.get(key, 0) + amount
+            for key, value, buckets in histograms:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(buckets)
+                histogram.observe(value)
+
+    def render(self, gauges=()):
+        """Prometheus text exposition; ``gauges`` adds (name, help, labels, value)"""
+        lines = []
+        with self._lock:
+            series = sorted(list(self._counters.items()) + list(self._histograms.items()),
+                            key=lambda item: (item[0][0], repr(item[0][1])))
+            described = set()
+            for (name, labels), value in series:
+                if name not in described and name in self._help:
+                    kind, help_text = self._help[name]
+                    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                described.add(name)
+                if isinstance(value, Histogram):
+                    lines += value.render(name, labels)
+                else:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+        for name, help_text, labels, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge',
+                      f'{name}{_labels(tuple(labels.items()))} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'histogram', 'Request latency by route')
+registry.describe('http_sql_duration_seconds', 'histogram', 'SQL execute and fetch time per request')
+registry.describe('http_serialize_duration_seconds', 'histogram', 'JSON encoding time per request')
+registry.describe('http_sql_rows', 'histogram', 'Rows fetched from SQLite per request')
+registry.describe('http_sql_queries_total', 'counter', 'SQL statements executed')
+registry.describe('openai_request_duration_seconds', 'histogram', 'OpenAI completion latency')
+registry.describe('openai_tokens_total', 'counter', 'OpenAI tokens used')
+registry.describe('sqlite_slow_queries_total', 'counter', 'Statements over the slow-query threshold')
+
+
+def _add(name, amount):
+    if has_app_context():
+        setattr(g, name, g.get(name, 0) + amount)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that adds its execute and fetch time and rows to the app context"""
+
+    _sql = None
+    _params = ()
+    _seconds = 0.0
+    _logged = False
+
+    def _track(self, start, rows=0):
+        elapsed = time.perf_counter() - start
+        self._seconds += elapsed
+        _add('sql_seconds', elapsed)
+        _add('sql_rows', rows)
+        if (_slow_query_seconds is not None and not self._logged
+                and self._seconds >= _slow_query_seconds
+                and not self._sql.lstrip().upper().startswith('PRAGMA')):
+            self._logged = True
+            log_slow_query(self.connection, self._sql, self._params, self._seconds)
+
+    def execute(self, sql, parameters=()):
+        self._sql, self._params, self._seconds, self._logged = sql, parameters, 0.0, False
+        _add('sql_queries', 1)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._track(start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._track(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._track(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._track(start, len(rows))
+        return rows
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including ``conn.execute``) are TimedCursors"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        # The C-level shortcut would create a plain cursor
+        return self.cursor().execute(sql, parameters)
+
+
+def log_slow_query(conn, sql, params, seconds):
+    """Print a slow statement with its query plan and keep it for /api/metrics/slow-queries"""
+    try:
+        plan = [row[3] for row in conn.cursor(sqlite3.Cursor).execute(
+            f'EXPLAIN QUERY PLAN {sql}', params)]
+    except sqlite3.Error as e:
+        plan = [f'(no plan: {e})']
+    route = request.url_rule.rule if has_request_context() and request.url_rule else None
+    entry = {
+        'at': datetime.now().isoformat(),
+        'route': route,
+        'ms': round(seconds * 1000, 2),
+        'sql': ' '.join(sql.split()),
+        'params': [str(param) for param in params],
+        'plan': plan,
+    }
+    slow_queries.append(entry)
+    registry.inc('sqlite_slow_queries_total', route=route or '')
+    print(f"🐢 Slow query {entry['ms']}ms on {route}: {entry['sql']} | plan: {'; '.join(plan)}")
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that adds encoding time to the app context"""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _add('serialize_seconds', time.perf_counter() - start)
+
+
+def record_completion(call, seconds, usage=None):
+    """Record one OpenAI completion (``call`` is e.g. 'tools' or 'answer')"""
+    registry.observe('openai_request_duration_seconds', seconds, OPENAI_BUCKETS, call=call)
+    if usage is not None:
+        registry.inc('openai_tokens_total', getattr(usage, 'prompt_tokens', 0) or 0,
+                     call=call, type='prompt')
+        registry.inc('openai_tokens_total', getattr(usage, 'completion_tokens', 0) or 0,
+                     call=call, type='completion')
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _observe_request(ctx_g, route, method, status):
+    """Record one finished request from the totals gathered on its ``g``"""
+    registry.update(
+        counters=[('http_sql_queries_total', ctx_g.get('sql_queries', 0), route)],
+        histograms=[
+            ('http_request_duration_seconds', time.perf_counter() - ctx_g.request_started,
+             LATENCY_BUCKETS, dict(route, method=method, status=status)),
+            ('http_sql_duration_seconds', ctx_g.get('sql_seconds', 0.0), LATENCY_BUCKETS, route),
+            ('http_serialize_duration_seconds', ctx_g.get('serialize_seconds', 0.0),
+             LATENCY_BUCKETS, route),
+            ('http_sql_rows', ctx_g.get('sql_rows', 0), ROWS_BUCKETS, route),
+        ])
+
+
+def _record_request(response):
+    if g.get('request_started') is None:
+        return response
+    args = (g._get_current_object(),
+            {'route': request.url_rule.rule if request.url_rule else 'unmatched'},
+            request.method, response.status_code)
+    if response.is_streamed:
+        # Exports and SSE run their queries while the body is sent (inside
+        # stream_with_context, so they still add to this g); record once it closes
+        response.call_on_close(lambda: _observe_request(*args))
+    else:
+        _observe_request(*args)
+    return response
+
+
+def init_app(app, slow_query_ms=None):
+    """Time every request; ``slow_query_ms`` enables the slow-query log"""
+    global _slow_query_seconds
+    _slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else None
+    app.json = TimedJSONProvider(app)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
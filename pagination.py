@@ -0,0 +1,169 @@
+"""Keyset pagination and streaming export for the list endpoints.
+
+List queries are ordered by a sort column and rowid, both descending, and
+select those two values as their last two columns. A page token encodes the
+pair from the last row served, and the next page seeks past it with the row
+value ``(sort, rowid) < (?, ?)``. Given an ascending index ending in the sort
+column (rowid is its implicit last key), SQLite walks that index backwards
+from the token, with no sort step, however deep the client pages. NULL sort
+values fail the comparison, so they are read as a separate final segment
+that is merged after the seek. Tokens go out in an ``X-Next-Cursor`` header
+and a ``Link: rel="next"`` header, which keeps the JSON body a plain list.
+
+``format=ndjson`` or ``format=csv`` streams the whole result set from the
+cursor instead, in fixed-size batches with constant memory.
+
+A ``decoder(columns) -> (columns, row -> row)`` can extend each visible row,
+e.g. with reference-code descriptions, after it is read.
+"""
+import base64
+import csv
+import io
+import json
+from urllib.parse import urlencode
+
+from flask import Response, jsonify, request, stream_with_context
+
+from cache import CACHE_PARAMS
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH_SIZE = 500
+HIDDEN_COLUMNS = 2  # trailing sort value and rowid
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (sort_value, row_id); raises ValueError for a malformed token"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_value, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if isinstance(row_id, bool) or not isinstance(row_id, int):
+        raise ValueError('Invalid cursor')
+    # Anything else would fail to bind as an SQL parameter
+    if isinstance(sort_value, bool) or not isinstance(sort_value, (str, int, float, type(None))):
+        raise ValueError('Invalid cursor')
+    return sort_value, row_id
+
+
+def next_link(token):
+    """Relative ``Link`` to the next page.
+
+    Carries only the args that select results (CACHE_PARAMS) plus the new
+    cursor, so a page served from the response cache never links to another
+    client's host or cache-buster args.
+    """
+    args = [(name, request.args[name].strip()) for name in CACHE_PARAMS
+            if name != 'cursor' and request.args.get(name, '').strip()]
+    args.append(('cursor', token))
+    return f'<{request.path}?{urlencode(args)}>; rel="next"'
+
+
+def page_size(default=DEFAULT_PAGE_SIZE):
+    """The request's ``limit``, clamped to 1..MAX_PAGE_SIZE"""
+    limit = int(request.args.get('limit', default))
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate(query, params, sort_column, row_column, after=None, limit=None):
+    """Append the keyset condition, ORDER BY and LIMIT to a list query.
+
+    ``query`` must end inside its WHERE clause. NULL sort values come last,
+    matching SQLite's DESC order: past a non-NULL token the query becomes the
+    seek UNION ALL the NULL rows, which SQLite merges in index order.
+    """
+    params = list(params)
+    if after is not None:
+        sort_value, row_id = after
+        if sort_value is None:
+            query += f" AND {sort_column} IS NULL AND {row_column} < ?"
+            params.append(row_id)
+        else:
+            query = (f"{query} AND ({sort_column}, {row_column}) < (?, ?)"
+                     f" UNION ALL {query} AND {sort_column} IS NULL")
+            params = params + [sort_value, row_id] + params
+    query += f" ORDER BY {sort_column} DESC, {row_column} DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def visible_rows(columns, decoder=None):
+    """(output columns, row -> visible row) for a list query's result columns"""
+    columns = columns[:-HIDDEN_COLUMNS]
+    if decoder is None:
+        return columns, lambda row: row[:-HIDDEN_COLUMNS]
+    columns, decode = decoder(columns)
+    return columns, lambda row: decode(row[:-HIDDEN_COLUMNS])
+
+
+def list_response(conn, query, params, sort_column, row_column, export_name, decoder=None):
+    """Serve a list query as a JSON page or a streamed NDJSON/CSV export.
+
+    Raises ValueError for a bad ``cursor``, ``limit`` or ``format``.
+    """
+    fmt = request.args.get('format', 'json')
+    token = request.args.get('cursor')
+    after = decode_cursor(token) if token else None
+    if fmt in EXPORT_FORMATS:
+        query, params = paginate(query, params, sort_column, row_column, after)
+        return export_response(conn.execute(query, params), fmt, export_name, decoder)
+    if fmt != 'json':
+        raise ValueError(f"format must be json, {', '.join(EXPORT_FORMATS)}")
+
+    limit = page_size()
+    # One extra row tells us whether there is a next page
+    query, params = paginate(query, params, sort_column, row_column, after, limit + 1)
+    cursor = conn.execute(query, params)
+    columns, visible = visible_rows([description[0] for description in cursor.description],
+                                    decoder)
+    rows = cursor.fetchall()
+
+    results = [dict(zip(columns, visible(row))) for row in rows[:limit]]
+    response = jsonify(results)
+    if len(rows) > limit:
+        next_token = encode_cursor(*rows[limit - 1][-HIDDEN_COLUMNS:])
+        response.headers['X-Next-Cursor'] = next_token
+        response.headers['Link'] = next_link(next_token)
+    return response
+
+
+def export_response(cursor, fmt, export_name, decoder=None):
+    """Stream every row of ``cursor`` as NDJSON or CSV"""
+    columns, visible = visible_rows([description[0] for description in cursor.description],
+                                    decoder)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for row in map(visible, rows):
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row))) + '\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={export_name}.{fmt}'
+    return response
@@ -0,0 +1,316 @@
+"""Precomputed per-PWSID compliance scorecards.
+
+A scorecard gathers everything an operator or inspector needs about one
+system: its inventory record, violation counts and recent violations, the
+lead/copper 90th-percentile trend against action levels, the latest site
+visit's evaluation codes, facilities and recent milestones, plus a few risk
+flags. Scorecards are built at ingest time, for each new data version, as one
+JSON document per PWSID in ``system_scorecard``, so the API serves a single
+primary-key lookup with no joins or re-serialization.
+"""
+import json
+
+from db import table_exists
+from summaries import ACTION_LEVELS, source
+
+SCORECARD_SQL = '''
+CREATE TABLE system_scorecard (
+    PWSID TEXT PRIMARY KEY,
+    scorecard TEXT NOT NULL
+) WITHOUT ROWID
+'''
+
+SCORECARD_QUERY = 'SELECT PWSID, scorecard FROM system_scorecard WHERE PWSID IN ({placeholders})'
+
+BUILD_BATCH_SIZE = 500  # PWSIDs assembled per pass, bounding memory
+RECENT_LIMIT = 5  # recent violations and milestones kept per system
+TREND_LIMIT = 8  # 90th-percentile sampling periods kept per contaminant
+
+EVAL_COLUMNS = (
+    'MANAGEMENT_OPS_EVAL_CODE', 'SOURCE_WATER_EVAL_CODE', 'SECURITY_EVAL_CODE',
+    'PUMPS_EVAL_CODE', 'OTHER_EVAL_CODE', 'COMPLIANCE_EVAL_CODE',
+    'DATA_VERIFICATION_EVAL_CODE', 'TREATMENT_EVAL_CODE',
+    'FINISHED_WATER_STOR_EVAL_CODE', 'DISTRIBUTION_EVAL_CODE', 'FINANCIAL_EVAL_CODE',
+)
+SIGNIFICANT_DEFICIENCY = 'S'
+
+# Keys holding reference codes in each scorecard section, for decode=1.
+# Keys repeat across sections ('code' is a violation code in one and a
+# milestone code in another), so each section is decoded with its own map.
+SECTION_CODE_COLUMNS = {
+    'system': {'type': 'PWS_TYPE_CODE', 'activity': 'PWS_ACTIVITY_CODE',
+               'owner_type': 'OWNER_TYPE_CODE', 'primary_source': 'PRIMARY_SOURCE_CODE'},
+    'violations': {'code': 'VIOLATION_CODE', 'category': 'VIOLATION_CATEGORY_CODE',
+                   'contaminant': 'CONTAMINANT_CODE'},
+    'site_visits': dict({'last_visit_reason': 'VISIT_REASON_CODE'},
+                        **{col[:-len('_EVAL_CODE')].lower(): col for col in EVAL_COLUMNS}),
+    'milestones': {'code': 'EVENT_MILESTONE_CODE', 'reason': 'EVENT_REASON_CODE'},
+}
+
+# Columns read from each source table; see summaries.source for tables that
+# were not loaded
+SCORECARD_COLUMNS = {
+    'sdwa_pub_water_systems': ('PWSID', 'PWS_NAME', 'PWS_TYPE_CODE', 'PWS_ACTIVITY_CODE',
+                               'OWNER_TYPE_CODE', 'PRIMARY_SOURCE_CODE',
+                               'POPULATION_SERVED_COUNT', 'SERVICE_CONNECTIONS_COUNT',
+                               'CITY_NAME', 'ZIP_CODE', 'PHONE_NUMBER', 'EMAIL_ADDR'),
+    'sdwa_violations_enforcement': ('PWSID', 'VIOLATION_ID', 'VIOLATION_CODE',
+                                    'VIOLATION_CATEGORY_CODE', 'CONTAMINANT_CODE',
+                                    'IS_HEALTH_BASED_IND', 'VIOLATION_STATUS',
+                                    'NON_COMPL_PER_BEGIN_DATE', 'NON_COMPL_PER_END_DATE'),
+    'sdwa_lcr_samples': ('PWSID', 'CONTAMINANT_CODE', 'SAMPLING_END_DATE', 'SAMPLE_MEASURE',
+                         'UNIT_OF_MEASURE'),
+    'sdwa_site_visits': ('PWSID', 'VISIT_ID', 'VISIT_DATE', 'VISIT_REASON_CODE') + EVAL_COLUMNS,
+    'sdwa_facilities': ('PWSID', 'FACILITY_ID', 'FACILITY_ACTIVITY_CODE', 'FACILITY_TYPE_CODE',
+                        'IS_SOURCE_IND'),
+    'sdwa_events_milestones': ('PWSID', 'EVENT_SCHEDULE_ID', 'EVENT_MILESTONE_CODE',
+                               'EVENT_REASON_CODE', 'EVENT_ACTUAL_DATE', 'EVENT_END_DATE'),
+}
+
+# One query per section, each returning rows for a PWSID range ordered by PWSID
+SECTION_QUERIES = {
+    'systems': '''
+        SELECT p.*, s.violation_count, s.health_violation_count, s.open_violation_count,
+               s.site_visit_count, s.last_visit_date
+        FROM {sdwa_pub_water_systems} p
+        JOIN summary_pwsid s ON s.PWSID = p.PWSID
+        WHERE p.PWSID BETWEEN ? AND ?
+    ''',
+    'violations': '''
+        SELECT PWSID, VIOLATION_ID, VIOLATION_CODE, VIOLATION_CATEGORY_CODE, CONTAMINANT_CODE,
+               IS_HEALTH_BASED_IND, VIOLATION_STATUS, NON_COMPL_PER_BEGIN_DATE,
+               NON_COMPL_PER_END_DATE
+        FROM (
+            SELECT v.*, ROW_NUMBER() OVER (
+                PARTITION BY PWSID ORDER BY NON_COMPL_PER_BEGIN_DATE DESC, VIOLATION_ID DESC
+            ) AS n
+            FROM (SELECT * FROM {sdwa_violations_enforcement} WHERE PWSID BETWEEN ? AND ?
+                  GROUP BY PWSID, VIOLATION_ID) v
+        )
+        WHERE n <= {recent}
+        ORDER BY PWSID, n
+    ''',
+    'lead_copper': '''
+        SELECT PWSID, CONTAMINANT_CODE, SAMPLING_END_DATE, SAMPLE_MEASURE, UNIT_OF_MEASURE,
+               n, sample_count, max_measure
+        FROM (
+            SELECT *, ROW_NUMBER() OVER w AS n,
+                   COUNT(*) OVER (PARTITION BY PWSID, CONTAMINANT_CODE) AS sample_count,
+                   MAX(SAMPLE_MEASURE) OVER (PARTITION BY PWSID, CONTAMINANT_CODE) AS max_measure
+            FROM {sdwa_lcr_samples}
+            WHERE PWSID BETWEEN ? AND ? AND CONTAMINANT_CODE IS NOT NULL
+            WINDOW w AS (PARTITION BY PWSID, CONTAMINANT_CODE
+                         ORDER BY SAMPLING_END_DATE DESC)
+        )
+        WHERE n <= {trend}
+        ORDER BY PWSID, CONTAMINANT_CODE, n
+    ''',
+    'site_visit': '''
+        SELECT * FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY PWSID ORDER BY VISIT_DATE DESC, VISIT_ID DESC
+            ) AS n
+            FROM {sdwa_site_visits}
+            WHERE PWSID BETWEEN ? AND ?
+        )
+        WHERE n = 1
+    ''',
+    'facilities': '''
+        SELECT PWSID, FACILITY_TYPE_CODE, COUNT(*) AS total,
+               COUNT(CASE WHEN FACILITY_ACTIVITY_CODE = 'A' THEN 1 END) AS active,
+               COUNT(CASE WHEN FACILITY_ACTIVITY_CODE = 'A' AND IS_SOURCE_IND = 'Y'
+                          THEN 1 END) AS active_sources
+        FROM {sdwa_facilities}
+        WHERE PWSID BETWEEN ? AND ?
+        GROUP BY PWSID, FACILITY_TYPE_CODE
+    ''',
+    'milestones': '''
+        SELECT PWSID, EVENT_MILESTONE_CODE, EVENT_REASON_CODE, EVENT_ACTUAL_DATE, EVENT_END_DATE
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY PWSID ORDER BY EVENT_ACTUAL_DATE DESC, EVENT_SCHEDULE_ID DESC
+            ) AS n
+            FROM {sdwa_events_milestones}
+            WHERE PWSID BETWEEN ? AND ?
+        )
+        WHERE n <= {recent}
+        ORDER BY PWSID, n
+    ''',
+}
+
+
+def _rows_by_pwsid(cursor, query, first, last):
+    """{PWSID: [row dict, ...]} for one section query over a PWSID range"""
+    cursor.execute(query, [first, last])
+    columns = [description[0] for description in cursor.description]
+    rows = {}
+    for row in cursor.fetchall():
+        record = dict(zip(columns, row))
+        rows.setdefault(record['PWSID'], []).append(record)
+    return rows
+
+
+def lead_copper_trend(samples):
+    """Per-contaminant 90th-percentile trend (newest first) against its action level"""
+    trends = {}
+    for row in samples:
+        code = row['CONTAMINANT_CODE']
+        trend = trends.get(code)
+        if trend is None:
+            action_level = ACTION_LEVELS.get(code) if row['UNIT_OF_MEASURE'] == 'mg/L' else None
+            trend = trends[code] = {
+                'unit': row['UNIT_OF_MEASURE'],
+                'sample_count': row['sample_count'],
+                'latest': row['SAMPLE_MEASURE'],
+                'latest_date': row['SAMPLING_END_DATE'],
+                'max': row['max_measure'],
+                'action_level': action_level,
+                'exceeds_action_level': (action_level is not None
+                                         and row['SAMPLE_MEASURE'] is not None
+                                         and row['SAMPLE_MEASURE'] > action_level),
+                'direction': None,
+                'periods': [],
+            }
+        trend['periods'].append({'date': row['SAMPLING_END_DATE'], 'value': row['SAMPLE_MEASURE']})
+    for trend in trends.values():
+        values = [period['value'] for period in trend['periods'][:2]]
+        if len(values) == 2 and None not in values:
+            trend['direction'] = ('up' if values[0] > values[1]
+                                  else 'down' if values[0] < values[1] else 'flat')
+    return trends
+
+
+def build_scorecard(system, violations, samples, visit, facilities, milestones):
+    """Assemble one system's scorecard dict from its section rows"""
+    lead_copper = lead_copper_trend(samples)
+    evaluations = {}
+    if visit:
+        evaluations = {col[:-len('_EVAL_CODE')].lower(): visit[col]
+                       for col in EVAL_COLUMNS if visit.get(col)}
+    significant = sum(1 for code in evaluations.values() if code == SIGNIFICANT_DEFICIENCY)
+    return {
+        'pwsid': system['PWSID'],
+        'system': {
+            'name': system['PWS_NAME'],
+            'type': system['PWS_TYPE_CODE'],
+            'activity': system['PWS_ACTIVITY_CODE'],
+            'owner_type': system['OWNER_TYPE_CODE'],
+            'primary_source': system['PRIMARY_SOURCE_CODE'],
+            'population_served': system['POPULATION_SERVED_COUNT'],
+            'service_connections': system['SERVICE_CONNECTIONS_COUNT'],
+            'city': system['CITY_NAME'],
+            'zip_code': system['ZIP_CODE'],
+            'phone': system['PHONE_NUMBER'],
+            'email': system['EMAIL_ADDR'],
+        },
+        'violations': {
+            'total': system['violation_count'],
+            'health_based': system['health_violation_count'],
+            'open': system['open_violation_count'],
+            'recent': [{
+                'violation_id': row['VIOLATION_ID'],
+                'code': row['VIOLATION_CODE'],
+                'category': row['VIOLATION_CATEGORY_CODE'],
+                'contaminant': row['CONTAMINANT_CODE'],
+                'health_based': row['IS_HEALTH_BASED_IND'] == 'Y',
+                'status': row['VIOLATION_STATUS'],
+                'begin_date': row['NON_COMPL_PER_BEGIN_DATE'],
+                'end_date': row['NON_COMPL_PER_END_DATE'],
+            } for row in violations],
+        },
+        'lead_copper': lead_copper,
+        'site_visits': {
+            'total': system['site_visit_count'],
+            'last_visit_date': system['last_visit_date'],
+            'last_visit_reason': visit['VISIT_REASON_CODE'] if visit else None,
+            'evaluations': evaluations,
+        },
+        'facilities': {
+            'total': sum(row['total'] for row in facilities),
+            'active': sum(row['active'] for row in facilities),
+            'active_sources': sum(row['active_sources'] for row in facilities),
+            'active_by_type': {row['FACILITY_TYPE_CODE']: row['active']
+                               for row in facilities if row['active']},
+        },
+        'milestones': [{
+            'code': row['EVENT_MILESTONE_CODE'],
+            'reason': row['EVENT_REASON_CODE'],
+            'actual_date': row['EVENT_ACTUAL_DATE'],
+            'end_date': row['EVENT_END_DATE'],
+        } for row in milestones],
+        'risk': {
+            'health_based_violations': system['health_violation_count'],
+            'open_violations': system['open_violation_count'],
+            'lead_action_level_exceeded': lead_copper.get('PB90', {}).get('exceeds_action_level', False),
+            'copper_action_level_exceeded': lead_copper.get('CU90', {}).get('exceeds_action_level', False),
+            'latest_visit_significant_deficiencies': significant,
+        },
+    }
+
+
+def refresh_scorecards(cursor, rebuild=False):
+    """(Re)build ``system_scorecard`` inside the caller's transaction.
+
+    Builds when ``rebuild`` is set (new data version) or the table is
+    missing, in PWSID batches of BUILD_BATCH_SIZE. Returns True if it built.
+    Requires the summary tables to be current.
+    """
+    if not rebuild and table_exists(cursor, 'system_scorecard'):
+        return False
+    cursor.execute('DROP TABLE IF EXISTS system_scorecard')
+    cursor.execute(SCORECARD_SQL)
+    if not table_exists(cursor, 'sdwa_pub_water_systems'):
+        return True
+
+    sources = {table: source(cursor, table, columns)
+               for table, columns in SCORECARD_COLUMNS.items()}
+    queries = {name: query.format(recent=RECENT_LIMIT, trend=TREND_LIMIT, **sources)
+               for name, query in SECTION_QUERIES.items()}
+    cursor.execute('SELECT PWSID FROM sdwa_pub_water_systems ORDER BY PWSID')
+    pwsids = [row[0] for row in cursor.fetchall()]
+    for start in range(0, len(pwsids), BUILD_BATCH_SIZE):
+        batch = pwsids[start:start + BUILD_BATCH_SIZE]
+        sections = {name: _rows_by_pwsid(cursor, query, batch[0], batch[-1])
+                    for name, query in queries.items()}
+        documents = []
+        for pwsid, (system,) in sections['systems'].items():
+            visits = sections['site_visit'].get(pwsid)
+            scorecard = build_scorecard(
+                system,
+                sections['violations'].get(pwsid, []),
+                sections['lead_copper'].get(pwsid, []),
+                visits[0] if visits else None,
+                sections['facilities'].get(pwsid, []),
+                sections['milestones'].get(pwsid, []),
+            )
+            documents.append((pwsid, json.dumps(scorecard, separators=(',', ':'))))
+        cursor.executemany('INSERT INTO system_scorecard VALUES (?, ?)', documents)
+    return True
+
+
+def get_scorecards(conn, pwsids):
+    """{PWSID: scorecard JSON text} for the PWSIDs that exist"""
+    placeholders = ', '.join('?' for _ in pwsids)
+    cursor = conn.execute(SCORECARD_QUERY.format(placeholders=placeholders), list(pwsids))
+    return dict(cursor.fetchall())
+
+
+def decode_scorecard(scorecard, codes):
+    """A scorecard dict with descriptions added by a codes.ReferenceCodes.
+
+    Code values get a ``<key>_description`` next to them; the contaminant
+    codes keying ``lead_copper`` and the facility type codes keying
+    ``active_by_type`` get a ``<key>_descriptions`` map alongside.
+    """
+    decoded = dict(scorecard)
+    for section, aliases in SECTION_CODE_COLUMNS.items():
+        if section in decoded:
+            decoded[section] = codes.decode_records(decoded[section], aliases)
+    decoded['lead_copper_descriptions'] = {
+        code: codes.describe('CONTAMINANT_CODE', code) for code in decoded.get('lead_copper', {})}
+    facilities = decoded.get('facilities')
+    if facilities:
+        decoded['facilities'] = dict(facilities, active_by_type_descriptions={
+            code: codes.describe('FACILITY_TYPE_CODE', code)
+            for code in facilities.get('active_by_type', {})})
+    return decoded
@@ -0,0 +1,132 @@
+"""Trigram full-text search over water systems and the places they serve.
+
+Two FTS5 tables are rebuilt at ingest time:
+
+- ``search_index`` holds one row per water system, facility, city, county and
+  ZIP code, and backs ranked type-ahead lookups via ``search``.
+- ``pws_city_fts`` is an external-content index over
+  ``sdwa_pub_water_systems.CITY_NAME`` so the ``city`` filter of
+  /api/water-systems keeps its ``LIKE '%city%'`` semantics without scanning.
+"""
+from db import table_exists
+
+MIN_QUERY_LENGTH = 3  # trigram indexes cannot match shorter strings
+SEARCH_KINDS = ('system', 'facility', 'city', 'county', 'zip')
+
+SEARCH_INDEX_SQL = '''
+CREATE VIRTUAL TABLE search_index USING fts5(
+    label, pwsid, kind UNINDEXED, detail UNINDEXED, system_count UNINDEXED,
+    tokenize = 'trigram'
+)
+'''
+
+CITY_INDEX_SQL = '''
+CREATE VIRTUAL TABLE pws_city_fts USING fts5(
+    CITY_NAME, content = 'sdwa_pub_water_systems', tokenize = 'trigram'
+)
+'''
+
+# Each source is only indexed if its table was loaded
+SEARCH_SOURCES = {
+    'sdwa_pub_water_systems': [
+        '''
+        INSERT INTO search_index (label, pwsid, kind, detail, system_count)
+        SELECT PWS_NAME, PWSID, 'system', CITY_NAME, 1
+        FROM sdwa_pub_water_systems WHERE PWS_NAME IS NOT NULL
+        ''',
+        '''
+        INSERT INTO search_index (label, pwsid, kind, detail, system_count)
+        SELECT CITY_NAME, NULL, 'city', STATE_CODE, COUNT(DISTINCT PWSID)
+        FROM sdwa_pub_water_systems WHERE CITY_NAME IS NOT NULL
+        GROUP BY CITY_NAME
+        ''',
+    ],
+    'sdwa_geographic_areas': [
+        '''
+        INSERT INTO search_index (label, pwsid, kind, detail, system_count)
+        SELECT COUNTY_SERVED, NULL, 'county', NULL, COUNT(DISTINCT PWSID)
+        FROM sdwa_geographic_areas WHERE AREA_TYPE_CODE = 'CN' AND COUNTY_SERVED IS NOT NULL
+        GROUP BY COUNTY_SERVED
+        ''',
+        '''
+        INSERT INTO search_index (label, pwsid, kind, detail, system_count)
+        SELECT ZIP_CODE_SERVED, NULL, 'zip', NULL, COUNT(DISTINCT PWSID)
+        FROM sdwa_geographic_areas WHERE ZIP_CODE_SERVED IS NOT NULL
+        GROUP BY ZIP_CODE_SERVED
+        ''',
+    ],
+    'sdwa_facilities': [
+        '''
+        INSERT INTO search_index (label, pwsid, kind, detail, system_count)
+        SELECT FACILITY_NAME, PWSID, 'facility', FACILITY_TYPE_CODE, 1
+        FROM sdwa_facilities
+        WHERE FACILITY_NAME IS NOT NULL AND FACILITY_ACTIVITY_CODE = 'A'
+        ''',
+    ],
+}
+
+SEARCH_QUERY = '''
+SELECT kind, label, pwsid, detail, system_count
+FROM search_index
+WHERE search_index MATCH ?
+ORDER BY (label LIKE ? ESCAPE '\\') DESC, rank
+LIMIT ?
+'''
+
+SEARCH_KIND_QUERY = '''
+SELECT kind, label, pwsid, detail, system_count
+FROM search_index
+WHERE search_index MATCH ? AND kind = ?
+ORDER BY (label LIKE ? ESCAPE '\\') DESC, rank
+LIMIT ?
+'''
+
+
+def refresh_search_index(cursor, rebuild=False):
+    """(Re)build the search tables inside the caller's transaction.
+
+    Builds when ``rebuild`` is set (new data version) or a table is missing.
+    Returns True if it built.
+    """
+    if not rebuild and table_exists(cursor, 'search_index') and table_exists(cursor, 'pws_city_fts'):
+        return False
+    cursor.execute('DROP TABLE IF EXISTS search_index')
+    cursor.execute(SEARCH_INDEX_SQL)
+    for table_name, statements in SEARCH_SOURCES.items():
+        if not table_exists(cursor, table_name):
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+    cursor.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
+    cursor.execute('DROP TABLE IF EXISTS pws_city_fts')
+    if table_exists(cursor, 'sdwa_pub_water_systems'):
+        cursor.execute(CITY_INDEX_SQL)
+        cursor.execute("INSERT INTO pws_city_fts (pws_city_fts) VALUES ('rebuild')")
+    return True
+
+
+def match_expression(text):
+    """Quote user text as a single FTS5 phrase (substring match for trigram)"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search(conn, text, kind=None, limit=10):
+    """Ranked matches for ``text``; labels starting with it rank first.
+
+    Raises ValueError for queries shorter than MIN_QUERY_LENGTH or an
+    unknown kind.
+    """
+    text = text.strip()
+    if len(text) < MIN_QUERY_LENGTH:
+        raise ValueError(f'Search text must be at least {MIN_QUERY_LENGTH} characters')
+    prefix = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    if kind:
+        if kind not in SEARCH_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(SEARCH_KINDS)}")
+        params = [match_expression(text), kind, prefix, limit]
+        cursor = conn.execute(SEARCH_KIND_QUERY, params)
+    else:
+        cursor = conn.execute(SEARCH_QUERY, [match_expression(text), prefix, limit])
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
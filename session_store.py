@@ -0,0 +1,185 @@
+"""Bounded, persistent chat history for /api/chat.
+
+History lives in its own SQLite database (WAL, busy timeout) so it survives
+restarts and is shared by every worker process. Each session keeps at most
+``max_turns`` messages and ``max_tokens`` estimated tokens verbatim; older
+messages are folded into a running summary that is sent to the model as a
+system message, so prompt size stays bounded however long a chat runs.
+Sessions idle for ``idle_ttl`` seconds are dropped, and when the store as a
+whole exceeds ``global_max_tokens`` the least recently active sessions go
+first.
+"""
+import sqlite3
+import threading
+import time
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS chat_sessions (
+        session_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL DEFAULT '',
+        token_count INTEGER NOT NULL DEFAULT 0,
+        last_active REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS chat_messages_session ON chat_messages (session_id, id)',
+    'CREATE INDEX IF NOT EXISTS chat_sessions_last_active ON chat_sessions (last_active)',
+]
+
+SUMMARY_MAX_TOKENS = 500
+DIGEST_CHARS = 200  # characters kept from each compacted message
+EVICT_INTERVAL = 30.0  # seconds between idle/global-cap sweeps per process
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token plus message overhead)"""
+    return len(text) // 4 + 4
+
+
+def compact_summary(summary, messages, max_tokens=SUMMARY_MAX_TOKENS):
+    """Fold ``messages`` into ``summary`` as one digest line each.
+
+    The oldest lines are dropped once the summary exceeds ``max_tokens``.
+    """
+    lines = summary.splitlines() if summary else []
+    for role, content in messages:
+        digest = ' '.join(content.split())
+        if len(digest) > DIGEST_CHARS:
+            digest = digest[:DIGEST_CHARS].rstrip() + '…'
+        lines.append(f'- {role}: {digest}')
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+class SessionStore:
+    """SQLite-backed chat history with per-session and global budgets"""
+
+    def __init__(self, database_path, max_turns=20, max_tokens=4000,
+                 idle_ttl=24 * 3600, global_max_tokens=5_000_000):
+        self.database_path = database_path
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+        self.global_max_tokens = global_max_tokens
+        self._local = threading.local()
+        self._last_evict = 0.0
+        conn = self._connect()
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.database_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def history(self, session_id):
+        """Messages to send to the model: the summary, then recent turns"""
+        conn = self._connect()
+        row = conn.execute('SELECT summary FROM chat_sessions WHERE session_id = ?',
+                           [session_id]).fetchone()
+        messages = []
+        if row and row[0]:
+            messages.append({
+                'role': 'system',
+                'content': f'Summary of the earlier conversation:\n{row[0]}',
+            })
+        cursor = conn.execute(
+            'SELECT role, content FROM chat_messages WHERE session_id = ? ORDER BY id',
+            [session_id])
+        messages.extend({'role': role, 'content': content} for role, content in cursor)
+        return messages
+
+    def append(self, session_id, role, content):
+        """Add a message, compacting the session back under its budgets"""
+        content = content or ''
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                INSERT INTO chat_sessions (session_id, last_active) VALUES (?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET last_active = excluded.last_active
+            ''', [session_id, now])
+            conn.execute(
+                'INSERT INTO chat_messages (session_id, role, content, tokens) VALUES (?, ?, ?, ?)',
+                [session_id, role, content, estimate_tokens(content)])
+            self._compact(conn, session_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if now - self._last_evict > EVICT_INTERVAL:
+            self._last_evict = now
+            self.evict()
+
+    def _compact(self, conn, session_id):
+        rows = conn.execute(
+            'SELECT id, role, content, tokens FROM chat_messages WHERE session_id = ? ORDER BY id',
+            [session_id]).fetchall()
+        total = sum(row[3] for row in rows)
+        keep_from = 0
+        # Always keep the newest message verbatim
+        while keep_from < len(rows) - 1 and (
+                len(rows) - keep_from > self.max_turns or total > self.max_tokens):
+            total -= rows[keep_from][3]
+            keep_from += 1
+
+        summary = conn.execute('SELECT summary FROM chat_sessions WHERE session_id = ?',
+                               [session_id]).fetchone()[0]
+        if keep_from:
+            compacted = rows[:keep_from]
+            summary = compact_summary(summary, [(row[1], row[2]) for row in compacted])
+            conn.execute('DELETE FROM chat_messages WHERE session_id = ? AND id <= ?',
+                         [session_id, compacted[-1][0]])
+        conn.execute('UPDATE chat_sessions SET summary = ?, token_count = ? WHERE session_id = ?',
+                     [summary, total + (estimate_tokens(summary) if summary else 0), session_id])
+
+    def evict(self):
+        """Drop idle sessions, then the least recently active ones over the global cap"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cutoff = time.time() - self.idle_ttl
+            conn.execute('''
+                DELETE FROM chat_messages WHERE session_id IN
+                    (SELECT session_id FROM chat_sessions WHERE last_active < ?)
+            ''', [cutoff])
+            conn.execute('DELETE FROM chat_sessions WHERE last_active < ?', [cutoff])
+            total = conn.execute('SELECT COALESCE(SUM(token_count), 0) FROM chat_sessions').fetchone()[0]
+            if total > self.global_max_tokens:
+                victims = []
+                for session_id, tokens in conn.execute(
+                        'SELECT session_id, token_count FROM chat_sessions ORDER BY last_active'):
+                    if total <= self.global_max_tokens:
+                        break
+                    victims.append(session_id)
+                    total -= tokens
+                conn.executemany('DELETE FROM chat_messages WHERE session_id = ?',
+                                 [[session_id] for session_id in victims])
+                conn.executemany('DELETE FROM chat_sessions WHERE session_id = ?',
+                                 [[session_id] for session_id in victims])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        conn = self._connect()
+        sessions, tokens = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(token_count), 0) FROM chat_sessions').fetchone()
+        return {'sessions': sessions, 'tokens': tokens,
+                'global_max_tokens': self.global_max_tokens}
@@ -0,0 +1,266 @@
+"""Materialized summary tables built at ingest time.
+
+The SDWA data changes once a quarter, so the aggregates behind the chat
+context, /api/counties and /api/trends are computed once per data version
+instead of on every request. ``summary_meta`` records the data version the tables were
+built from; ``refresh_summaries`` is a no-op until the ingest manifest changes.
+"""
+import hashlib
+
+from db import table_exists
+
+SUMMARY_META_SQL = '''
+CREATE TABLE IF NOT EXISTS summary_meta (
+    data_version TEXT NOT NULL,
+    built_at TEXT NOT NULL
+)
+'''
+
+# Columns each summary reads from the source tables. A source table that was
+# not loaded (e.g. no violations CSV) is replaced by an empty derived table
+# with these columns so the summaries still build.
+SOURCE_COLUMNS = {
+    'sdwa_pub_water_systems': ('PWSID', 'PWS_NAME', 'PWS_TYPE_CODE', 'PWS_ACTIVITY_CODE',
+                               'POPULATION_SERVED_COUNT'),
+    'sdwa_violations_enforcement': ('PWSID', 'VIOLATION_ID', 'CONTAMINANT_CODE',
+                                    'IS_HEALTH_BASED_IND', 'VIOLATION_STATUS',
+                                    'NON_COMPL_PER_BEGIN_DATE'),
+    'sdwa_lcr_samples': ('PWSID', 'CONTAMINANT_CODE', 'SAMPLE_MEASURE', 'UNIT_OF_MEASURE',
+                         'SAMPLING_END_DATE'),
+    'sdwa_geographic_areas': ('PWSID', 'AREA_TYPE_CODE', 'COUNTY_SERVED'),
+    'sdwa_facilities': ('PWSID', 'FACILITY_ID', 'FACILITY_ACTIVITY_CODE'),
+    'sdwa_site_visits': ('PWSID', 'VISIT_ID', 'VISIT_DATE'),
+}
+
+# VIOLATION_STATUS values that still need action
+OPEN_VIOLATION_STATUSES = ('Unaddressed', 'Addressed')
+
+# Lead and copper action levels (mg/L) for the 90th-percentile values
+ACTION_LEVELS = {'PB90': 0.015, 'CU90': 1.3}
+
+# Bump when a summary table's columns change so existing databases rebuild
+SUMMARY_SCHEMA_VERSION = 3
+
+# Dates are ISO text (normalized at ingest), so periods are string slices
+QUARTER_SQL = "substr({date}, 1, 4) || '-Q' || ((CAST(substr({date}, 6, 2) AS INTEGER) + 2) / 3)"
+
+SUMMARY_TABLES = {
+    'summary_overview': '''
+        CREATE TABLE summary_overview AS
+        SELECT 'total_systems' AS key, COUNT(*) AS value FROM {pws}
+        UNION ALL SELECT 'active_systems', COUNT(*) FROM {pws} WHERE PWS_ACTIVITY_CODE = 'A'
+        UNION ALL SELECT 'total_violations', COUNT(*) FROM {violations}
+        UNION ALL SELECT 'health_violations', COUNT(*) FROM {violations}
+            WHERE IS_HEALTH_BASED_IND = 'Y'
+        UNION ALL SELECT 'total_samples', COUNT(*) FROM {samples}
+        UNION ALL SELECT 'counties', COUNT(DISTINCT COUNTY_SERVED) FROM {geo}
+            WHERE AREA_TYPE_CODE = 'CN'
+    ''',
+    'summary_county': '''
+        CREATE TABLE summary_county AS
+        SELECT g.COUNTY_SERVED,
+               COUNT(*) AS system_count,
+               COUNT(CASE WHEN p.PWS_ACTIVITY_CODE = 'A' THEN 1 END) AS active_systems,
+               SUM(CASE WHEN p.PWS_ACTIVITY_CODE = 'A'
+                        THEN p.POPULATION_SERVED_COUNT ELSE 0 END) AS population_served
+        FROM {geo} g
+        LEFT JOIN {pws} p ON p.PWSID = g.PWSID
+        WHERE g.AREA_TYPE_CODE = 'CN' AND g.COUNTY_SERVED IS NOT NULL
+        GROUP BY g.COUNTY_SERVED
+    ''',
+    'summary_system_type': '''
+        CREATE TABLE summary_system_type AS
+        SELECT PWS_TYPE_CODE,
+               COUNT(*) AS system_count,
+               COUNT(CASE WHEN PWS_ACTIVITY_CODE = 'A' THEN 1 END) AS active_systems,
+               SUM(CASE WHEN PWS_ACTIVITY_CODE = 'A'
+                        THEN POPULATION_SERVED_COUNT ELSE 0 END) AS population_served
+        FROM {pws}
+        GROUP BY PWS_TYPE_CODE
+    ''',
+    'summary_contaminant': '''
+        CREATE TABLE summary_contaminant AS
+        SELECT CONTAMINANT_CODE,
+               SUM(sample_count) AS sample_count,
+               MAX(max_measure) AS max_measure,
+               SUM(violation_count) AS violation_count,
+               SUM(health_violation_count) AS health_violation_count
+        FROM (
+            SELECT CONTAMINANT_CODE, COUNT(*) AS sample_count,
+                   MAX(SAMPLE_MEASURE) AS max_measure,
+                   0 AS violation_count, 0 AS health_violation_count
+            FROM {samples} GROUP BY CONTAMINANT_CODE
+            UNION ALL
+            SELECT CONTAMINANT_CODE, 0, NULL, COUNT(DISTINCT VIOLATION_ID),
+                   COUNT(DISTINCT CASE WHEN IS_HEALTH_BASED_IND = 'Y' THEN VIOLATION_ID END)
+            FROM {violations} GROUP BY CONTAMINANT_CODE
+        )
+        WHERE CONTAMINANT_CODE IS NOT NULL
+        GROUP BY CONTAMINANT_CODE
+    ''',
+    'summary_pwsid': '''
+        CREATE TABLE summary_pwsid AS
+        SELECT p.PWSID, p.PWS_NAME, p.PWS_TYPE_CODE, p.PWS_ACTIVITY_CODE,
+               p.POPULATION_SERVED_COUNT,
+               COALESCE(v.violation_count, 0) AS violation_count,
+               COALESCE(v.health_violation_count, 0) AS health_violation_count,
+               COALESCE(v.open_violation_count, 0) AS open_violation_count,
+               COALESCE(v.open_health_violation_count, 0) AS open_health_violation_count,
+               COALESCE(s.sample_count, 0) AS sample_count,
+               s.last_sample_date,
+               COALESCE(f.active_facility_count, 0) AS active_facility_count,
+               COALESCE(sv.site_visit_count, 0) AS site_visit_count,
+               sv.last_visit_date
+        FROM {pws} p
+        LEFT JOIN (
+            SELECT PWSID, COUNT(DISTINCT VIOLATION_ID) AS violation_count,
+                   COUNT(DISTINCT CASE WHEN IS_HEALTH_BASED_IND = 'Y'
+                                       THEN VIOLATION_ID END) AS health_violation_count,
+                   COUNT(DISTINCT CASE WHEN VIOLATION_STATUS IN {open_statuses}
+                                       THEN VIOLATION_ID END) AS open_violation_count,
+                   COUNT(DISTINCT CASE WHEN IS_HEALTH_BASED_IND = 'Y'
+                                        AND VIOLATION_STATUS IN {open_statuses}
+                                       THEN VIOLATION_ID END) AS open_health_violation_count
+            FROM {violations} GROUP BY PWSID
+        ) v ON v.PWSID = p.PWSID
+        LEFT JOIN (
+            SELECT PWSID, COUNT(*) AS sample_count, MAX(SAMPLING_END_DATE) AS last_sample_date
+            FROM {samples} GROUP BY PWSID
+        ) s ON s.PWSID = p.PWSID
+        LEFT JOIN (
+            SELECT PWSID, COUNT(*) AS active_facility_count
+            FROM {facilities} WHERE FACILITY_ACTIVITY_CODE = 'A' GROUP BY PWSID
+        ) f ON f.PWSID = p.PWSID
+        LEFT JOIN (
+            SELECT PWSID, COUNT(*) AS site_visit_count, MAX(VISIT_DATE) AS last_visit_date
+            FROM {site_visits} GROUP BY PWSID
+        ) sv ON sv.PWSID = p.PWSID
+    ''',
+    'summary_violation_quarter': '''
+        CREATE TABLE summary_violation_quarter AS
+        SELECT PWSID, {violation_quarter} AS quarter, CONTAMINANT_CODE,
+               COUNT(DISTINCT VIOLATION_ID) AS violation_count,
+               COUNT(DISTINCT CASE WHEN IS_HEALTH_BASED_IND = 'Y'
+                                   THEN VIOLATION_ID END) AS health_violation_count
+        FROM {violations}
+        WHERE NON_COMPL_PER_BEGIN_DATE IS NOT NULL
+        GROUP BY PWSID, quarter, CONTAMINANT_CODE
+    ''',
+    'summary_violation_month': '''
+        CREATE TABLE summary_violation_month AS
+        SELECT substr(NON_COMPL_PER_BEGIN_DATE, 1, 7) AS month,
+               COUNT(DISTINCT VIOLATION_ID) AS violation_count,
+               COUNT(DISTINCT CASE WHEN IS_HEALTH_BASED_IND = 'Y'
+                                   THEN VIOLATION_ID END) AS health_violation_count,
+               COUNT(DISTINCT PWSID) AS system_count
+        FROM {violations}
+        WHERE NON_COMPL_PER_BEGIN_DATE IS NOT NULL
+        GROUP BY month
+    ''',
+    'summary_lcr_year': '''
+        CREATE TABLE summary_lcr_year AS
+        SELECT PWSID, CONTAMINANT_CODE, substr(SAMPLING_END_DATE, 1, 4) AS year,
+               COUNT(*) AS sample_count,
+               MAX(SAMPLE_MEASURE) AS max_measure,
+               COUNT(CASE WHEN SAMPLE_MEASURE > {action_level} THEN 1 END) AS exceedance_count
+        FROM {samples}
+        WHERE CONTAMINANT_CODE IN ('PB90', 'CU90') AND UNIT_OF_MEASURE = 'mg/L'
+              AND SAMPLING_END_DATE IS NOT NULL AND SAMPLE_MEASURE IS NOT NULL
+        GROUP BY PWSID, CONTAMINANT_CODE, year
+    ''',
+    # Statewide nearest-rank percentiles of each system's yearly highest 90th-percentile value
+    'summary_lcr_percentiles': '''
+        CREATE TABLE summary_lcr_percentiles AS
+        SELECT CONTAMINANT_CODE, year, COUNT(*) AS system_count,
+               MIN(CASE WHEN rank >= 0.5 * total THEN max_measure END) AS p50,
+               MIN(CASE WHEN rank >= 0.9 * total THEN max_measure END) AS p90,
+               MAX(max_measure) AS max_measure,
+               SUM(exceedance_count > 0) AS systems_over_action_level
+        FROM (
+            SELECT CONTAMINANT_CODE, year, max_measure, exceedance_count,
+                   ROW_NUMBER() OVER (PARTITION BY CONTAMINANT_CODE, year
+                                      ORDER BY max_measure) AS rank,
+                   COUNT(*) OVER (PARTITION BY CONTAMINANT_CODE, year) AS total
+            FROM summary_lcr_year
+        )
+        GROUP BY CONTAMINANT_CODE, year
+    ''',
+}
+
+SUMMARY_INDEXES = [
+    'CREATE UNIQUE INDEX summary_overview_key ON summary_overview (key, value)',
+    'CREATE INDEX summary_county_rank ON summary_county (system_count DESC, COUNTY_SERVED)',
+    'CREATE UNIQUE INDEX summary_system_type_code ON summary_system_type (PWS_TYPE_CODE)',
+    'CREATE UNIQUE INDEX summary_contaminant_code ON summary_contaminant (CONTAMINANT_CODE)',
+    'CREATE UNIQUE INDEX summary_pwsid_id ON summary_pwsid (PWSID)',
+    'CREATE INDEX summary_violation_quarter_pwsid '
+    'ON summary_violation_quarter (PWSID, quarter, CONTAMINANT_CODE)',
+    'CREATE INDEX summary_violation_quarter_contaminant '
+    'ON summary_violation_quarter (CONTAMINANT_CODE, quarter)',
+    'CREATE UNIQUE INDEX summary_violation_month_key ON summary_violation_month (month)',
+    'CREATE UNIQUE INDEX summary_lcr_year_pwsid '
+    'ON summary_lcr_year (PWSID, CONTAMINANT_CODE, year)',
+    'CREATE UNIQUE INDEX summary_lcr_percentiles_key '
+    'ON summary_lcr_percentiles (CONTAMINANT_CODE, year)',
+]
+
+
+def data_version(cursor):
+    """Short hash of the ingest manifest and summary schema version.
+
+    Changes whenever any file changes or the summary tables change shape.
+    """
+    cursor.execute('SELECT table_name, sha256 FROM ingest_manifest ORDER BY table_name')
+    digest = hashlib.sha256(f'schema:{SUMMARY_SCHEMA_VERSION};'.encode())
+    for table_name, sha256 in cursor.fetchall():
+        digest.update(f'{table_name}:{sha256};'.encode())
+    return digest.hexdigest()[:16]
+
+
+def source(cursor, table_name, columns=None):
+    """The table itself, or an empty stand-in if it was never loaded.
+
+    The stand-in has ``columns`` (default: SOURCE_COLUMNS for the table).
+    """
+    if table_exists(cursor, table_name):
+        return table_name
+    columns = ', '.join(f'NULL AS {col}' for col in columns or SOURCE_COLUMNS[table_name])
+    return f'(SELECT {columns} WHERE 0)'
+
+
+def built_version(cursor):
+    """Data version the summaries were last built from, or None"""
+    cursor.execute(SUMMARY_META_SQL)
+    cursor.execute('SELECT data_version FROM summary_meta')
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def refresh_summaries(cursor, version, force=False):
+    """Rebuild every summary table if ``version`` differs from the built one.
+
+    Runs inside the caller's transaction. Returns True if it rebuilt.
+    """
+    if not force and built_version(cursor) == version:
+        return False
+    cursor.execute(SUMMARY_META_SQL)  # a forced build may be the first one
+    sources = {
+        'pws': source(cursor, 'sdwa_pub_water_systems'),
+        'violations': source(cursor, 'sdwa_violations_enforcement'),
+        'samples': source(cursor, 'sdwa_lcr_samples'),
+        'geo': source(cursor, 'sdwa_geographic_areas'),
+        'facilities': source(cursor, 'sdwa_facilities'),
+        'site_visits': source(cursor, 'sdwa_site_visits'),
+        'open_statuses': str(OPEN_VIOLATION_STATUSES),
+        'violation_quarter': QUARTER_SQL.format(date='NON_COMPL_PER_BEGIN_DATE'),
+        'action_level': 'CASE CONTAMINANT_CODE {} END'.format(' '.join(
+            f"WHEN '{code}' THEN {level}" for code, level in ACTION_LEVELS.items())),
+    }
+    for table_name, create_sql in SUMMARY_TABLES.items():
+        cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+        cursor.execute(create_sql.format(**sources))
+    for index_sql in SUMMARY_INDEXES:
+        cursor.execute(index_sql)
+    cursor.execute('DELETE FROM summary_meta')
+    cursor.execute("INSERT INTO summary_meta VALUES (?, datetime('now'))", [version])
+    return True
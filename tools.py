@@ -0,0 +1,160 @@
+"""Concurrent execution of the tool calls in one chat turn.
+
+When the model asks for several functions at once (violations, samples,
+facilities...) they are independent reads, so they run together on a bounded
+thread pool and the turn pays for the slowest call instead of the sum. Results
+come back in the model's original order, a call that overruns its timeout is
+reported to the model as an error, and per-function timings are kept so
+/api/chat/stats shows which tools dominate chat latency. Each call's timeout
+counts from when a worker starts it, so time spent queued behind other turns'
+calls is not charged to it; a separate queue timeout bounds that wait.
+
+Tool results are pure functions of their arguments and the loaded data, so
+with a cache they are memoized on (function name, canonical args, data
+version); a new ingest changes the version and retires every entry.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class ToolTimings:
+    """Thread-safe per-function call counts and latencies"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _entry(self, name):
+        return self._stats.setdefault(name, {
+            'calls': 0, 'errors': 0, 'timeouts': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+        })
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._entry(name)
+            stats['calls'] += 1
+            if error:
+                stats['errors'] += 1
+            ms = seconds * 1000
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+
+    def record_timeout(self, name):
+        # The call's latency is recorded when its thread eventually finishes
+        # (never, for a call cancelled before it started)
+        with self._lock:
+            self._entry(name)['timeouts'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(stats,
+                           total_ms=round(stats['total_ms'], 2),
+                           max_ms=round(stats['max_ms'], 2),
+                           avg_ms=round(stats['total_ms'] / stats['calls'], 2)
+                           if stats['calls'] else 0.0)
+                for name, stats in self._stats.items()
+            }
+
+
+def tool_cache_key(name, args, version):
+    """Function name + args as canonical JSON + data version"""
+    return (name, json.dumps(args, sort_keys=True, separators=(',', ':')), version)
+
+
+class ToolRunner:
+    """Run a turn's tool calls on a shared, bounded thread pool.
+
+    ``execute(name, args)`` is called in a worker thread; pass ``app`` to give
+    each call its own app context (and so its own pooled connection), and an
+    ``LRUCache`` as ``cache`` to memoize results per data version. A call
+    gets ``timeout`` seconds once running and waits at most ``queue_timeout``
+    (default: ``timeout``) for a free worker.
+    """
+
+    def __init__(self, execute, max_workers=8, timeout=15.0, app=None, cache=None,
+                 queue_timeout=None):
+        self.execute = execute
+        self.timeout = timeout
+        self.queue_timeout = timeout if queue_timeout is None else queue_timeout
+        self.app = app
+        self.cache = cache
+        self.timings = ToolTimings()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='tool')
+
+    def _call(self, name, args, started):
+        started['at'] = time.monotonic()
+        start = time.perf_counter()
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    result = self.execute(name, args)
+            else:
+                result = self.execute(name, args)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            self.timings.record(name, elapsed, error=True)
+            return {'error': str(e)}, elapsed
+        elapsed = time.perf_counter() - start
+        self.timings.record(name, elapsed)
+        return result, elapsed
+
+    def _wait(self, future, started, submitted):
+        """(result, seconds) of a submitted call.
+
+        Raises TimeoutError once the call has run for ``timeout`` seconds, or
+        has waited ``queue_timeout`` seconds without starting.
+        """
+        while True:
+            began = started.get('at')
+            limit = submitted + self.queue_timeout if began is None else began + self.timeout
+            try:
+                return future.result(timeout=max(0.0, limit - time.monotonic()))
+            except TimeoutError:
+                if started.get('at') == began:
+                    raise
+                # It started while we waited: give it its own full timeout
+
+    def run(self, calls, version=None):
+        """Execute ``[(name, args), ...]`` concurrently.
+
+        Returns ``[(result, seconds), ...]`` in the same order; cached results
+        take 0 seconds. A call still running ``timeout`` seconds after it
+        started, or not started within ``queue_timeout``, yields an error
+        result; a running call's thread finishes in the background. Nothing is
+        cached without a data ``version``.
+        """
+        use_cache = self.cache is not None and version is not None
+        submitted = time.monotonic()
+        pending = []
+        for name, args in calls:
+            cached = self.cache.get(tool_cache_key(name, args, version)) if use_cache else None
+            if cached is not None:
+                pending.append((cached, None, None))
+                continue
+            started = {}
+            pending.append((None, self._executor.submit(self._call, name, args, started), started))
+
+        results = []
+        for (name, args), (cached, future, started) in zip(calls, pending):
+            if future is None:
+                results.append((cached, 0.0))
+                continue
+            try:
+                result, seconds = self._wait(future, started, submitted)
+            except TimeoutError:
+                future.cancel()
+                self.timings.record_timeout(name)
+                if 'at' in started:
+                    error = f'{name} timed out after {self.timeout:g}s'
+                else:
+                    error = f'{name} did not start within {self.queue_timeout:g}s (tool workers busy)'
+                results.append(({'error': error}, time.monotonic() - started.get('at', submitted)))
+                continue
+            if use_cache and not (isinstance(result, dict) and 'error' in result):
+                self.cache.set(tool_cache_key(name, args, version), result)
+            results.append((result, seconds))
+        return results